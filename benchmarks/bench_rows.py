@@ -0,0 +1,65 @@
+"""
+Compare building batch ops through pandas and through the streaming row
+source. Each mode runs in its own process to report its peak memory.
+
+    python benchmarks/bench_rows.py [file.csv[.gz] | megabytes]
+
+Without a file, a csv of the given size (default 100 MB) is generated.
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from lateral.loader import ApiLoader, CsvDef
+
+TEXT = "lorem ipsum dolor sit amet consectetur adipiscing elit " * 20
+
+
+def make_csv(megabytes):
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        f.write("body,name,year\n")
+        i = 0
+        while f.tell() < megabytes * 1024 * 1024:
+            f.write('"{} {}",doc{},{}\n'.format(TEXT, i, i, 1900 + i % 100))
+            i += 1
+    return path
+
+
+def run(mode, path):
+    loader = ApiLoader('bench', pool_size=0)
+    csvdef = CsvDef(path, 'body', {'name': 'title', 'year': 'year'})
+    t0 = time.time()
+    n = 0
+    if mode == 'pandas':
+        for df in loader.get_df(csvdef, 100):
+            n += len(loader.create_batch_request_data(df, csvdef))
+    else:
+        for ops in loader.batches(csvdef, 100):
+            n += len(ops)
+    dt = time.time() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print("{:<7} {:9d} docs {:8.1f} s {:9.0f} docs/s {:8.1f} MB peak".format(
+        mode, n, dt, n / dt, rss))
+
+
+def main(arg='100'):
+    path = arg if os.path.exists(arg) else make_csv(int(arg))
+    try:
+        print("{}: {:.0f} MB".format(path, os.path.getsize(path) / 1048576.))
+        for mode in ('pandas', 'rows'):
+            subprocess.check_call([sys.executable, __file__, '--run', mode,
+                                   path])
+    finally:
+        if path != arg:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(*sys.argv[2:])
+    else:
+        main(*sys.argv[1:])
@@ -0,0 +1,289 @@
+"""
+Benchmark suite of the hot paths of the client, run against the local fake
+server of :py:mod:`lateral.tests.fakeserver`:
+
+* latency of single API calls,
+* requests/s of threaded calls with and without the connection pool, and
+  with retried server errors,
+* upload size and time of plain and compressed batch bodies,
+* throughput of `ApiLoader.ingest` at several batch sizes,
+* paginated scans,
+* throughput of `tools.cut_pieces_txt`,
+* time to import the client modules in a fresh interpreter.
+
+Results are written as JSON with the commit they were measured at, so runs
+of two commits can be compared::
+
+    python benchmarks/run.py -o base.json
+    git checkout feature
+    python benchmarks/run.py -o new.json --compare base.json
+
+With `--compare`, metrics that got worse by more than `--threshold`
+(default 10%) are listed and the exit status is 1. `--quick` runs smaller
+workloads, `-k` selects benchmarks by name. `bench_rows.py` compares peak
+memory of csv sources and runs on its own, one process per mode.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+import lateral.api
+from lateral import codec, tools
+from lateral.loader import ApiLoader, CsvDef
+from lateral.resilience import RetryPolicy
+from lateral.tests.fakeserver import FakeServer
+
+TEXT = "lorem ipsum dolor sit amet consectetur adipiscing elit "
+
+BENCHMARKS = []
+
+
+def benchmark(f):
+    """Register `f(scale)`, generating `(name, value, unit, higher)` tuples,
+    `higher` telling whether higher values are better."""
+    BENCHMARKS.append(f)
+    return f
+
+
+def text_of(kb):
+    return (TEXT * (kb * 1024 // len(TEXT) + 1))[:kb * 1024]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+@benchmark
+def latency(scale):
+    calls = [
+        ('get_document', lambda api, i: api.get_document('doc{}'.format(i))),
+        ('get_documents_similar',
+         lambda api, i: api.get_documents_similar('doc{}'.format(i))),
+        ('post_document',
+         lambda api, i: api.post_document(TEXT, {'title': 'doc'})),
+        ('put_document',
+         lambda api, i: api.put_document('doc{}'.format(i), TEXT)),
+        ('get_user_recommendations',
+         lambda api, i: api.get_user_recommendations('user{}'.format(i))),
+        ('post_users_preference',
+         lambda api, i: api.post_users_preference('user1', 'doc{}'.format(i))),
+    ]
+    n = max(20, int(500 * scale))
+    with FakeServer() as server:
+        api = lateral.api.API('bench', url=server.url)
+        for name, call in calls:
+            times = []
+            for i in xrange(n):
+                t0 = time.time()
+                call(api, i)
+                times.append(time.time() - t0)
+            yield 'latency.{}.p50'.format(name), \
+                1000 * percentile(times, 0.5), 'ms', False
+            yield 'latency.{}.p95'.format(name), \
+                1000 * percentile(times, 0.95), 'ms', False
+        api.close()
+
+
+def requests_per_s(api, calls, threads):
+    pool = ThreadPool(threads)
+    t0 = time.time()
+    pool.map(lambda i: api.get_user_recommendations('user{}'.format(i)),
+             xrange(calls))
+    pool.close()
+    return calls / (time.time() - t0)
+
+
+@benchmark
+def session(scale, threads=8):
+    calls = max(100, int(2000 * scale))
+    with FakeServer() as server:
+        for pool_size in (0, threads):
+            api = lateral.api.API('bench', url=server.url, pool_size=pool_size)
+            yield 'session.pool{}'.format(pool_size), \
+                requests_per_s(api, calls, threads), 'requests/s', True
+            api.close()
+    with FakeServer(error_rate=0.1) as server:
+        api = lateral.api.API('bench', url=server.url, pool_size=threads,
+                              retry=RetryPolicy(retries=10, backoff=0.001))
+        yield 'session.retry_10pct_errors', \
+            requests_per_s(api, calls, threads), 'requests/s', True
+        api.close()
+
+
+@benchmark
+def batch_body(scale, text_kb=20):
+    batches = max(5, int(50 * scale))
+    ops = [{'method': 'POST', 'url': '/documents',
+            'params': {'text': text_of(text_kb), 'meta': '{}'}}] * 100
+    with FakeServer() as server:
+        for compress in (None, 'deflate', 'gzip'):
+            api = lateral.api.API('bench', url=server.url, compress=compress)
+            sent = sum(len(c) for c in
+                       codec.BatchBody(ops, api.hdr_json, compress=compress))
+            t0 = time.time()
+            for _ in xrange(batches):
+                api.post_batch(ops)
+            dt = time.time() - t0
+            api.close()
+            name = 'batch_body.{}'.format(compress or 'plain')
+            yield name + '.size', sent / 1024., 'kB/batch', False
+            yield name + '.time', 1000 * dt / batches, 'ms/batch', False
+
+
+def make_csv(docs):
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        f.write("body,name,year\n")
+        for i in xrange(docs):
+            f.write('"{} {}",doc{},{}\n'.format(TEXT * 20, i, i,
+                                                 1900 + i % 100))
+    return path
+
+
+@benchmark
+def ingest(scale):
+    docs = max(500, int(5000 * scale))
+    path = make_csv(docs)
+    csvdef = CsvDef(path, 'body', {'name': 'title', 'year': 'year'})
+    try:
+        with FakeServer(latency=0.005) as server:
+            server.collection('/documents', 0)  # progress reports get totals
+            for batchsize, in_flight in ((10, 1), (50, 1), (100, 1), (100, 4)):
+                loader = ApiLoader('bench', url=server.url)
+                loader.report = lambda event, **fields: None
+                stats = loader.ingest(csvdef, batchsize, in_flight=in_flight)
+                loader.close()
+                name = 'ingest.batch{}.in_flight{}'.format(batchsize,
+                                                           in_flight)
+                yield name, stats.docs_per_s, 'docs/s', True
+    finally:
+        os.remove(path)
+
+
+@benchmark
+def scan(scale):
+    total = max(1000, int(10000 * scale))
+    with FakeServer(latency=0.002) as server:
+        server.collection('/documents', total)
+        api = lateral.api.API('bench', url=server.url)
+        for per_page in (25, 100):
+            t0 = time.time()
+            n = sum(1 for _ in api.iter_documents(per_page=per_page))
+            yield 'scan.per_page{}'.format(per_page), \
+                n / (time.time() - t0), 'records/s', True
+        api.close()
+
+
+@benchmark
+def pieces(scale, length=1000, overlap=4, context=2):
+    kb = max(64, int(1024 * scale))
+    text = text_of(kb)
+    for name, cut in (('cut_pieces_txt', tools.cut_pieces_txt),
+                      ('cut_views', tools.cut_views)):
+        reps = 5
+        t0 = time.time()
+        for _ in xrange(reps):
+            for _ in cut(text, length, overlap, context):
+                pass
+        dt = (time.time() - t0) / reps
+        yield 'pieces.' + name, kb / 1024. / dt, 'MB/s', True
+
+
+IMPORT = "import time; t0 = time.time(); import {}; print(time.time() - t0)"
+
+
+@benchmark
+def imports(scale, reps=5):
+    for module in ('lateral.api', 'lateral.asyncapi', 'lateral.loader',
+                   'lateral.tools'):
+        seconds = min(float(subprocess.check_output(
+            [sys.executable, '-c', IMPORT.format(module)]))
+            for _ in xrange(reps))
+        yield 'import.' + module, 1000 * seconds, 'ms', False
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names=None, quick=False):
+    """Dict with `meta` describing the run and the `results` of the
+    benchmarks named in `names` (default all)."""
+    results = {}
+    for bench in BENCHMARKS:
+        if names and bench.__name__ not in names:
+            continue
+        for name, value, unit, higher in bench(0.1 if quick else 1.0):
+            results[name] = {'value': round(value, 4), 'unit': unit,
+                             'higher_is_better': higher}
+            sys.stderr.write("{:<46} {:12.3f} {}\n".format(name, value, unit))
+    return {'meta': {'commit': commit(), 'time': time.time(), 'quick': quick,
+                     'python': platform.python_version(),
+                     'platform': platform.platform()},
+            'results': results}
+
+
+def compare(base, new, threshold):
+    """Print the change of each metric and return the names of those that
+    got worse by more than `threshold`."""
+    worse = []
+    for name in sorted(new['results']):
+        if name not in base['results']:
+            continue
+        old, cur = base['results'][name], new['results'][name]
+        if not old['value']:
+            continue
+        change = (cur['value'] - old['value']) / old['value']
+        loss = -change if cur['higher_is_better'] else change
+        regressed = loss > threshold
+        if regressed:
+            worse.append(name)
+        print("{:<46} {:12.3f} {:12.3f} {:+7.1%}{}".format(
+            name, old['value'], cur['value'], change,
+            '  REGRESSION' if regressed else ''))
+    return worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-k', dest='names', action='append',
+                        help='run only this benchmark, can be repeated: ' +
+                        ', '.join(b.__name__ for b in BENCHMARKS))
+    parser.add_argument('-o', '--output', help='write results to this file')
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller workloads, for smoke tests')
+    parser.add_argument('--compare', help='results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.quick)
+    out = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    elif not args.compare:
+        print(out)
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+        worse = compare(base, results, args.threshold)
+        if worse:
+            print("{} regressions".format(len(worse)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,26 +7,109 @@ since the pagination information is only made available in the response
 headers.
 """
 
+import os
+import Queue
+import tempfile
+import threading
+import time
 import requests
-import ujson
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
 from urlparse import urljoin
+from lateral import codec
+from lateral.metrics import Call
+from lateral.resilience import (Counters, CircuitOpenError,
+                                DeadlineExceeded)
 
 
 class Request():
     """Basic requests to the Lateral API. Base class for higher level
     API wrapper classes."""
 
-    def __init__(self, key, url="http://api-v4.lateral.io", ignore=[406]):
+    def __init__(self, key, url="http://api-v4.lateral.io", ignore=[406],
+                 pool_size=10, cache=None, retry=None, limiters=[],
+                 compress=None, instruments=[], timeout=None, timeouts={},
+                 hedge=None, breaker=None, coalesce=None):
         """
         :param key: subscription key
         :param url: url of lateral instance
         :param ignore: list of integers representing status_codes that are not
         considered an error (default [406])
+        :param pool_size: number of keep-alive connections per host shared by
+        all threads using this instance, 0 opens a new connection for every
+        call (default 10)
+        :param cache: optional :py:class:`lateral.cache.ResponseCache` for GET
+        requests
+        :param retry: optional :py:class:`lateral.resilience.RetryPolicy`
+        :param limiters: list of limiters from :py:mod:`lateral.resilience`
+        every call has to pass
+        :param compress: 'gzip' or 'deflate' to compress the streamed bodies
+        of batch requests (default None)
+        :param instruments: list of instruments like
+        :py:class:`lateral.metrics.Metrics` notified of every call
+        :param timeout: seconds to wait for a response (default no limit)
+        :param timeouts: dict mapping endpoint templates to their timeout
+        :param hedge: optional :py:class:`lateral.resilience.Hedge` for GET
+        requests
+        :param breaker: optional :py:class:`lateral.resilience.CircuitBreaker`
+        :param coalesce: optional :py:class:`lateral.coalesce.Coalescer`
+        sharing and batching concurrent GET requests
         """
         self.url_base = url
         self.key = key
         self.ignore = ignore
         self.counter = 0
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self.session = self._session() if pool_size else None
+        self.hdr_json = codec.dumps(self._hdr())
+        self.cache = cache
+        self.retry = retry
+        self.limiters = limiters
+        self.compress = compress
+        self.instruments = instruments
+        self.timeout = timeout
+        self.timeouts = timeouts
+        self.hedge = hedge
+        self.breaker = breaker
+        self.coalesce = coalesce
+        self._hedge_pool = None
+        if hedge is not None:
+            from multiprocessing.pool import ThreadPool
+            self._hedge_pool = ThreadPool(2 * pool_size or 2)
+        self._local = threading.local()
+        self.counters = Counters()
+
+    def _session(self):
+        """Session with a blocking connection pool, so that threads beyond
+        `pool_size` wait for a free connection instead of opening throwaway
+        ones."""
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size, pool_block=True)
+        s.mount('http://', adapter)
+        s.mount('https://', adapter)
+        s.headers.update(self._hdr())
+        return s
+
+    def close(self):
+        """Release the pooled connections."""
+        if self._hedge_pool is not None:
+            self._hedge_pool.close()
+        if self.session is not None:
+            self.session.close()
+
+    @contextmanager
+    def deadline(self, seconds, fallback=None):
+        """Let calls of this thread inside the `with` block, retries
+        included, end within `seconds`. Calls that time out or are rejected
+        by the circuit breaker return `fallback(exception)` if given."""
+        old = getattr(self._local, 'options', None)
+        self._local.options = (time.time() + seconds, fallback)
+        try:
+            yield
+        finally:
+            self._local.options = old
 
     def _url(self, endpoint):
         return urljoin(self.url_base, endpoint)
@@ -35,11 +118,198 @@ class Request():
         return {'content-type': 'application/json',
                 'subscription-key': self.key}
 
-    def _request(self, method, endpoint, params=None, data={}):
-        self.counter += 1
+    def _send(self, method, endpoint, params=None, data={}, headers=None,
+              stream=False, timeout=None):
+        with self._lock:
+            self.counter += 1
+        if self.session is not None:
+            return self.session.request(method.upper(), self._url(endpoint),
+                                        params=params, data=data,
+                                        headers=headers, stream=stream,
+                                        timeout=timeout)
+        hdr = self._hdr()
+        hdr.update(headers or {})
         m = getattr(requests.api, method)
-        resp = m(self._url(endpoint), headers=self._hdr(), params=params,
-                 data=data)
+        return m(self._url(endpoint), headers=hdr, params=params, data=data,
+                 stream=stream, timeout=timeout)
+
+    def _download(self, endpoint, path, chunk_size=64 * 1024):
+        """Stream the body of GET `endpoint` to file `path` in chunks. The
+        call is retried, limited and instrumented like any other; the body
+        is written to a temporary file renamed to `path` once complete."""
+        resp = self._call('get', endpoint, None, {}, None, 0.0,
+                          self._options(), stream=True)
+        if not isinstance(resp, requests.Response):
+            return resp     # fallback of a timed out or rejected call
+        try:
+            if resp.status_code / 100 != 2:
+                return resp     # ignored status, nothing to save
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(path)),
+                prefix=os.path.basename(path) + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size):
+                        f.write(chunk)
+                os.rename(tmp, path)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        finally:
+            resp.close()
+        return resp
+
+    def _json(self, obj):
+        """Encode request body `obj`, timing it for the instruments."""
+        t0 = time.time()
+        data = codec.dumps(obj)
+        self._local.encode_time = (getattr(self._local, 'encode_time', 0.0) +
+                                   time.time() - t0)
+        return data
+
+    def _take_encode_time(self):
+        t = getattr(self._local, 'encode_time', 0.0)
+        self._local.encode_time = 0.0
+        return t
+
+    def _attempt(self, call):
+        """Send a call through limiters, instruments and cache, setting its
+        response or the exception raised."""
+        tokens = [l.acquire() for l in self.limiters]
+        for inst in self.instruments:
+            inst.before(call)
+        t0 = time.time()
+        try:
+            if self.cache is not None and not call.stream:
+                call.response = self.cache.request(
+                    self._send, call.method, call.endpoint, call.params,
+                    call.data, call.headers, call.timeout,
+                    (self.url_base, self.key))
+            else:
+                call.response = self._send(call.method, call.endpoint,
+                                           call.params, call.data,
+                                           call.headers, call.stream,
+                                           call.timeout)
+        except requests.exceptions.RequestException as e:
+            call.error = e
+        body_time = call.body_encode_time
+        call.encode_time += body_time
+        call.latency = time.time() - t0 - body_time
+        status = call.status
+        self.counters.record(status, call.latency)
+        for l, token in zip(self.limiters, tokens):
+            l.release(token, status)
+        for inst in self.instruments:
+            inst.after(call)
+        return call
+
+    def _hedged(self, call):
+        """Attempt a GET, sending a duplicate if it takes longer than the
+        hedge delay, and keep the first successful answer."""
+        answers = Queue.Queue()
+
+        def run(c):
+            try:
+                self._attempt(c)
+            except Exception as e:
+                c.error = e
+            answers.put(c)
+
+        self._hedge_pool.apply_async(run, (call,))
+        try:
+            first = answers.get(timeout=self.hedge.delay(call.template))
+        except Queue.Empty:
+            twin = Call(call.method, call.endpoint, call.template, call.params,
+                        call.data, call.headers, call.attempt, 0.0,
+                        call.timeout)
+            self._hedge_pool.apply_async(run, (twin,))
+            first = answers.get()
+            if first.error is not None:
+                first = answers.get()   # the other one may still succeed
+            self.hedge.count(first is twin)
+        if first.error is None:
+            self.hedge.record(call.template, first.latency)
+        return first
+
+    def _options(self):
+        """Deadline and fallback set by :py:meth:`deadline` for this thread."""
+        return getattr(self._local, 'options', None) or (None, None)
+
+    def _timeout(self, template, deadline):
+        timeout = self.timeouts.get(template, self.timeout)
+        if deadline is not None:
+            left = deadline - time.time()
+            if left <= 0:
+                raise DeadlineExceeded("deadline passed")
+            timeout = left if timeout is None else min(timeout, left)
+        return timeout
+
+    def _request(self, method, endpoint, params=None, data={}, headers=None):
+        return self._call(method, endpoint, params, data, headers,
+                          self._take_encode_time(), self._options())
+
+    def _call(self, method, endpoint, params, data, headers, encode_time,
+              options=(None, None), stream=False):
+        if self.coalesce is not None and method == 'get' and not stream:
+            return self.coalesce.get(self, endpoint, params, lambda o: (
+                self._perform(method, endpoint, params, data, headers,
+                              encode_time, o)), options)
+        return self._perform(method, endpoint, params, data, headers,
+                             encode_time, options, stream)
+
+    def _perform(self, method, endpoint, params, data, headers, encode_time,
+                 options, stream=False):
+        deadline, fallback = options
+        if fallback is None and self.breaker is not None:
+            fallback = self.breaker.fallback
+        template = None
+        if self.instruments or self.timeouts or self.hedge:
+            template = endpoint_template(endpoint)
+        attempt = 0
+        try:
+            while True:
+                timeout = self._timeout(template, deadline)
+                if self.breaker is not None and not self.breaker.allow():
+                    raise CircuitOpenError("circuit open: " + endpoint)
+                call = Call(method, endpoint, template, params, data, headers,
+                            attempt, 0.0 if attempt else encode_time, timeout,
+                            stream)
+                done = False
+                try:
+                    if (self.hedge is not None and method == 'get' and
+                            not stream):
+                        call = self._hedged(call)
+                    else:
+                        self._attempt(call)
+                    done = True
+                finally:
+                    if self.breaker is not None:
+                        if done:
+                            self.breaker.record(call.status)
+                        else:
+                            self.breaker.release()
+                resp, error = call.response, call.error
+                if self.retry is None or not self.retry.should_retry(
+                        method, attempt, resp, error):
+                    break
+                delay = self.retry.delay(attempt, resp)
+                if (deadline is not None and
+                        time.time() + delay + MIN_ATTEMPT >= deadline):
+                    break   # no time left for another attempt
+                if stream and resp is not None:
+                    resp.close()    # give its connection back to the pool
+                self.counters.retried()
+                time.sleep(delay)
+                attempt += 1
+            if error is not None:
+                raise error
+        except (CircuitOpenError, requests.exceptions.Timeout) as e:
+            if fallback is None:
+                raise
+            return fallback(e)
+        return self._checked(resp)
+
+    def _checked(self, resp):
         C = resp.status_code
         if C / 100 == 2 or self.ignore.count(C):
             return resp     # success
@@ -49,8 +319,8 @@ class Request():
     def _get(self, endpoint, **params):
         return self._request('get', endpoint, params=params)
 
-    def _post(self, endpoint, data={}):
-        return self._request('post', endpoint, data=data)
+    def _post(self, endpoint, data={}, headers=None):
+        return self._request('post', endpoint, data=data, headers=headers)
 
     def _put(self, endpoint, data={}):
         return self._request('put', endpoint, data=data)
@@ -58,6 +328,57 @@ class Request():
     def _delete(self, endpoint, data={}):
         return self._request('delete', endpoint, data=data)
 
+    def _resolve(self, r):
+        """Response of the value returned by an API method."""
+        return r
+
+    def _iter(self, method, args, params, per_page, max_items):
+        prefetch = params.pop('prefetch', True)
+        fetch = lambda page: self._resolve(getattr(self, method)(
+            *args, page=page, per_page=per_page, **params))
+        return paginate(fetch, per_page, max_items, prefetch)
+
+
+MIN_ATTEMPT = 0.05   # seconds a retry needs at least before the deadline
+
+ROUTES = [
+    'batch', 'delete-all-data',
+    'documents', 'documents/{id}', 'documents/similar-to-text',
+    'documents/popular', 'documents/{id}/tags', 'documents/{id}/tags/{tag_id}',
+    'documents/{id}/preferences', 'documents/{id}/similar',
+    'tags', 'tags/{id}', 'tags/{id}/documents',
+    'users', 'users/{id}', 'users/{id}/recommendations',
+    'users/{id}/preferences', 'users/{id}/preferences/{document_id}',
+    'cluster-models', 'cluster-models/{id}', 'cluster-models/{id}/clusters',
+    'cluster-models/{id}/clusters/{cluster_id}/documents',
+    'cluster-models/{id}/clusters/{cluster_id}/words',
+    'cluster-models/{id}/clusters/{cluster_id}/word-cloud',
+]
+_ROUTE_SEGMENTS = [(r, r.split('/')) for r in ROUTES]
+
+
+def endpoint_template(endpoint):
+    """
+    route of :py:data:`ROUTES` matching `endpoint`, e.g.
+    `documents/{id}/similar` for `documents/d1/similar`, preferring literal
+    matches. Unknown endpoints are returned unchanged.
+    """
+    segs = endpoint.strip('/').split('/')
+    best, best_literals = endpoint, -1
+    for route, rsegs in _ROUTE_SEGMENTS:
+        if len(rsegs) != len(segs):
+            continue
+        literals = 0
+        for r, s in zip(rsegs, segs):
+            if r == s:
+                literals += 1
+            elif not r.startswith('{'):
+                break
+        else:
+            if literals > best_literals:
+                best, best_literals = route, literals
+    return best
+
 
 def append_id(endpoint, _id):
     """
@@ -68,8 +389,92 @@ def append_id(endpoint, _id):
     return endpoint
 
 
+def paginate(fetch, per_page, max_items=None, prefetch=True):
+    """
+    Generate the records of all pages of a paginated endpoint. The next page
+    is fetched by a background thread while the current one is consumed; the
+    thread ends when the generator is exhausted, closed or collected.
+    :param fetch: function of the page number returning the response
+    :param per_page: page size used by `fetch`
+    :param max_items: stop after that many records (default all)
+    :param prefetch: False to fetch each page when it is needed, without
+    a thread, for callers iterating many short listings concurrently
+    """
+    if not prefetch:
+        return _paginate(fetch, per_page, max_items)
+    return _prefetched(fetch, per_page, max_items)
+
+
+def _pages(fetch, per_page, max_items):
+    """Generate `(records, last)` of the pages of a paginated endpoint."""
+    page, n = 1, 0
+    while True:
+        r = fetch(page)
+        records = codec.decode(r)
+        n += len(records)
+        total = r.headers.get('total')
+        last = (len(records) < per_page or
+                (total is not None and n >= int(total)) or
+                (max_items is not None and n >= max_items))
+        yield records, last
+        if last:
+            return
+        page += 1
+
+
+def _paginate(fetch, per_page, max_items):
+    n = 0
+    for records, _ in _pages(fetch, per_page, max_items):
+        for rec in records:
+            if max_items is not None and n >= max_items:
+                return
+            n += 1
+            yield rec
+
+
+def _prefetched(fetch, per_page, max_items):
+    pages = Queue.Queue(1)
+    stop = threading.Event()
+
+    def fetcher():
+        try:
+            for records, last in _pages(fetch, per_page, max_items):
+                pages.put((records, None, last))
+                if stop.is_set():
+                    return
+        except Exception as e:
+            pages.put((None, e, True))
+
+    thread = threading.Thread(target=fetcher)
+    thread.daemon = True
+    thread.start()
+    try:
+        n = 0
+        while True:
+            records, error, last = pages.get()
+            if error is not None:
+                raise error
+            for rec in records:
+                if max_items is not None and n >= max_items:
+                    return
+                n += 1
+                yield rec
+            if last:
+                return
+    finally:
+        stop.set()
+        try:
+            pages.get_nowait()  # unblock a fetcher waiting to put a page
+        except Queue.Empty:
+            pass
+
+
 class API(Request):
-    """All Lateral API requests (but batch request)."""
+    """All Lateral API requests.
+
+    Paginated endpoints `get_x` have a generator `iter_x` yielding the
+    decoded records of all pages, see :py:func:`paginate`; `prefetch=False`
+    fetches each page only when it is needed."""
 
     ######################
     # Documents
@@ -80,7 +485,7 @@ class API(Request):
 
     def post_document(self, text, meta={}, document_id=None):
         r = self._post(append_id('documents', document_id),
-                       ujson.dumps({"text": text, "meta": ujson.dumps(meta)}))
+                       self._json({"text": text, "meta": self._json(meta)}))
         return r
 
     def get_document(self, document_id):
@@ -89,7 +494,7 @@ class API(Request):
 
     def put_document(self, document_id, text, meta={}):
         r = self._put('documents/{}'.format(document_id),
-                      ujson.dumps({"text": text, "meta": ujson.dumps(meta)}))
+                      self._json({"text": text, "meta": self._json(meta)}))
         return r
 
     def delete_document(self, document_id):
@@ -104,26 +509,42 @@ class API(Request):
         r = self._get('documents/{}/preferences'.format(document_id), **params)
         return r
 
+    def iter_documents(self, per_page=100, max_items=None, **params):
+        return self._iter('get_documents', (), params, per_page, max_items)
+
+    def iter_documents_tags(self, document_id, per_page=100, max_items=None,
+                            **params):
+        return self._iter('get_documents_tags', (document_id,), params,
+                          per_page, max_items)
+
+    def iter_documents_preferences(self, document_id, per_page=100,
+                                   max_items=None, **params):
+        return self._iter('get_documents_preferences', (document_id,), params,
+                          per_page, max_items)
+
     def get_documents_similar(self, document_id, **params):
         r = self._get('documents/{}/similar'.format(document_id), **params)
         return r
 
     def post_documents_similar_to_text(self, text, **params):
         params['text'] = text
-        r = self._post('documents/similar-to-text', ujson.dumps(params))
+        r = self._post('documents/similar-to-text', self._json(params))
         return r
 
     def post_documents_popular(self, **params):
-        r = self._post('documents/popular', ujson.dumps(params))
+        r = self._post('documents/popular', self._json(params))
         return r
 
     ######################
     # Tags
 
-    def get_tags(self):
-        r = self._get('tags')
+    def get_tags(self, **params):
+        r = self._get('tags', **params)
         return r
 
+    def iter_tags(self, per_page=100, max_items=None, **params):
+        return self._iter('get_tags', (), params, per_page, max_items)
+
     def post_tag(self, tag_id):
         r = self._post('tags/{}'.format(tag_id))
         return r
@@ -143,6 +564,11 @@ class API(Request):
         r = self._get('tags/{}/documents'.format(tag_id), **params)
         return r
 
+    def iter_tags_documents(self, tag_id, per_page=100, max_items=None,
+                            **params):
+        return self._iter('get_tags_documents', (tag_id,), params, per_page,
+                          max_items)
+
     def post_documents_tagging(self, document_id, tag_id):
         r = self._post('documents/{}/tags/{}'.format(document_id, tag_id))
         return r
@@ -158,6 +584,9 @@ class API(Request):
         r = self._get('users', **params)
         return r
 
+    def iter_users(self, per_page=100, max_items=None, **params):
+        return self._iter('get_users', (), params, per_page, max_items)
+
     def post_user(self, user_id=None):
         r = self._post(append_id('users', user_id))
         return r
@@ -172,16 +601,21 @@ class API(Request):
 
     def get_user_recommendations(self, user_id, **params):
         r = self._get('users/{}/recommendations'.format(user_id),
-                      params=ujson.dumps(params))
+                      params=self._json(params))
         return r
 
     ######################
     # Preferences
 
-    def get_users_preferences(self, user_id):
-        r = self._get('users/{}/preferences'.format(user_id))
+    def get_users_preferences(self, user_id, **params):
+        r = self._get('users/{}/preferences'.format(user_id), **params)
         return r
 
+    def iter_users_preferences(self, user_id, per_page=100, max_items=None,
+                               **params):
+        return self._iter('get_users_preferences', (user_id,), params,
+                          per_page, max_items)
+
     def get_users_preference(self, user_id, document_id):
         r = self._get('users/{}/preferences/{}'.format(user_id, document_id))
         return r
@@ -191,7 +625,8 @@ class API(Request):
         return r
 
     def delete_users_preference(self, user_id, document_id):
-        r = self._delete('users/{}/preferences/{}'.format(user_id, document_id))
+        r = self._delete('users/{}/preferences/{}'.format(user_id,
+                                                          document_id))
         return r
 
     ######################
@@ -201,8 +636,13 @@ class API(Request):
         r = self._get('cluster-models', **params)
         return r
 
+    def iter_cluster_models(self, per_page=100, max_items=None, **params):
+        return self._iter('get_cluster_models', (), params, per_page,
+                          max_items)
+
     def post_cluster_model(self, size):
-        r = self._post('cluster-models', data='{"number_clusters":%d}' % (size))
+        r = self._post('cluster-models',
+                       data='{"number_clusters":%d}' % (size))
         return r
 
     def get_cluster_model(self, cluster_model_id):
@@ -232,9 +672,33 @@ class API(Request):
                 cluster_model_id, cluster_id))
         return r
 
+    def save_clusters_word_cloud(self, cluster_model_id, cluster_id, path):
+        r = self._download('cluster-models/{}/clusters/{}/word-cloud'.format(
+                cluster_model_id, cluster_id), path)
+        return r
+
+    ######################
+    # Batch
+
+    def post_batch(self, ops, sequential=True):
+        body = codec.BatchBody(ops, self.hdr_json, sequential, self.compress)
+        headers = ({'content-encoding': self.compress} if self.compress
+                   else None)
+        r = self._post('batch', body, headers)
+        return r
+
+    def batch(self, size=100, parallel=1, sequential=True):
+        """:py:class:`lateral.batch.Batch` recording calls to this API as
+        batch ops, to be used as context manager."""
+        from lateral.batch import Batch
+        return Batch(self, size, parallel, sequential)
+
     ######################
     # Generic
 
     def delete_all_data(self):
         r = self._delete('delete-all-data')
         return r
+
+
+Api = API   # name used by the README and :py:mod:`lateral.loader`
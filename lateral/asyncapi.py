@@ -0,0 +1,53 @@
+"""
+Implements subclass :py:class:`lateral.asyncapi.AsyncAPI` of
+:py:class:`lateral.api.API` whose calls do not block.
+
+Every API method returns at once with a handle. ``handle.get()`` waits for
+and returns the requests.Response, pagination headers included, or raises
+the error of the call.
+"""
+from multiprocessing.pool import ThreadPool
+import lateral.api
+
+
+class AsyncAPI(lateral.api.API):
+    """All methods of :py:class:`lateral.api.API`, returning handles."""
+
+    def __init__(self, key, url="http://api-v4.lateral.io", ignore=[406],
+                 concurrency=10, **kwargs):
+        """
+        :param concurrency: maximum number of calls in flight, also the size
+        of the shared connection pool unless `pool_size` is given
+        (default 10)
+        :param kwargs: further arguments of :py:class:`lateral.api.Request`
+        like `cache`, `retry`, `timeout`, `hedge`, `breaker` or `coalesce`
+        """
+        kwargs.setdefault('pool_size', concurrency)
+        lateral.api.API.__init__(self, key, url, ignore, **kwargs)
+        self.concurrency = concurrency
+        self.pool = ThreadPool(concurrency)
+
+    def _request(self, method, endpoint, params=None, data={}, headers=None):
+        return self.pool.apply_async(
+            self._call, (method, endpoint, params, data, headers,
+                         self._take_encode_time(), self._options()))
+
+    def _resolve(self, r):
+        return r.get()
+
+    def gather(self, handles, timeout=None):
+        """Wait for all `handles` and return their responses in order."""
+        return [h.get(timeout) for h in handles]
+
+    def fan_out(self, method, *iterables):
+        """Call API method `method` once per tuple of arguments taken from
+        `iterables` and return all responses in order, e.g.
+        ``api.fan_out('get_user_recommendations', user_ids)``."""
+        m = getattr(self, method)
+        return self.gather([m(*args) for args in zip(*iterables)])
+
+    def close(self):
+        """Wait for the calls in flight and release threads and connections."""
+        self.pool.close()
+        self.pool.join()
+        lateral.api.API.close(self)
@@ -0,0 +1,172 @@
+"""
+Implements :py:class:`lateral.batch.Batch`, which records calls of
+:py:class:`lateral.api.API` methods as ops of `/batch` requests instead of
+sending them one by one::
+
+    with api.batch() as b:
+        handles = [b.post_users_preference(u, d) for u, d in pairs]
+    results = [h.get() for h in handles]
+
+Each handle resolves to the result of its op in the batch response, a dict
+with its `status` and `body`. Ops still recorded when the `with` block
+raises are not sent, their handles raise.
+"""
+import threading
+import types
+from multiprocessing.pool import ThreadPool
+import lateral.api
+from lateral import codec
+
+MAX_OPS = 100   # maximum number of ops per batch request
+
+# prefixes of the API methods that can be recorded
+RECORDED = ('get_', 'post_', 'put_', 'delete_')
+
+
+class BatchOp(object):
+    """Handle of one recorded call."""
+
+    def __init__(self, op):
+        self.op = op
+        self.result = None
+        self.error = None
+        self.scheduled = False  # handed over to be sent without further calls
+        self._done = threading.Event()
+
+    def set(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the op to be answered, return False on timeout."""
+        return self._done.wait(timeout)
+
+    def get(self, timeout=None):
+        """Wait for and return the op's result, raise the error of the batch
+        request it was sent with."""
+        if not self.scheduled:
+            raise RuntimeError("batch op not sent yet: {}".format(self.op))
+        if not self._done.wait(timeout):
+            raise RuntimeError("batch op not answered yet: {}".format(self.op))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def resolve(handles, results):
+    """Set the results of a batch response to its handles, failing those
+    the response has no result for."""
+    for i, h in enumerate(handles):
+        if i < len(results):
+            h.set(results[i])
+        else:
+            h.set(error=RuntimeError(
+                "batch response has no result for op {}".format(h.op)))
+
+
+class Batch(object):
+    """All request methods of :py:class:`lateral.api.API`, recorded as
+    batch ops and sent in chunks of up to `size` ops through `api`."""
+
+    def __init__(self, api, size=MAX_OPS, parallel=1, sequential=True):
+        """
+        :param api: :py:class:`lateral.api.API` sending the batch requests
+        :param size: ops per batch request, at most 100
+        :param parallel: number of batch requests sent concurrently
+        :param sequential: let the server run the ops of a batch in order
+        """
+        self.api = api
+        self.size = min(size, MAX_OPS)
+        self.sequential = sequential
+        self.pool = ThreadPool(parallel) if parallel > 1 else None
+        self.pending = []
+        self.sent = []
+
+    def __getattr__(self, name):
+        """API method `name` bound to this batch, so its request is recorded
+        rather than sent."""
+        method = getattr(lateral.api.API, name, None)
+        if method is None or not name.startswith(RECORDED) or \
+                name == 'post_batch':
+            raise AttributeError(name)
+        return types.MethodType(method.__func__, self)
+
+    def _json(self, obj):
+        return codec.dumps(obj)
+
+    def _get(self, endpoint, **params):
+        return self._request('get', endpoint, params=params)
+
+    def _post(self, endpoint, data={}, headers=None):
+        return self._request('post', endpoint, data=data)
+
+    def _put(self, endpoint, data={}):
+        return self._request('put', endpoint, data=data)
+
+    def _delete(self, endpoint, data={}):
+        return self._request('delete', endpoint, data=data)
+
+    def _request(self, method, endpoint, params=None, data={}, headers=None):
+        op = {'method': method.upper(), 'url': '/' + endpoint.lstrip('/')}
+        if data:
+            op['params'] = codec.loads(data)
+        elif params:
+            op['params'] = params
+        handle = BatchOp(op)
+        self.pending.append(handle)
+        if len(self.pending) >= self.size:
+            self.flush()
+        return handle
+
+    def _resolve(self, r):
+        return r.get()
+
+    def _send_ops(self, handles):
+        try:
+            r = self.api.post_batch([h.op for h in handles], self.sequential)
+            results = codec.decode(self.api._resolve(r))['results']
+        except Exception as e:
+            for h in handles:
+                h.set(error=e)
+            return
+        resolve(handles, results)
+
+    def flush(self):
+        """Send the recorded ops."""
+        handles, self.pending = self.pending, []
+        if not handles:
+            return
+        for h in handles:
+            h.scheduled = True
+        if self.pool is None:
+            self._send_ops(handles)
+        else:
+            self.sent = [s for s in self.sent if not s.ready()]
+            self.sent.append(self.pool.apply_async(self._send_ops, (handles,)))
+
+    def close(self):
+        """Send the remaining ops and wait for all batch requests."""
+        self.flush()
+        if self.pool is not None:
+            for s in self.sent:
+                s.get()
+            self.pool.close()
+            self.pool.join()
+        self.sent = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:    # send nothing more of a failed block
+            handles, self.pending = self.pending, []
+            for h in handles:
+                h.scheduled = True
+                h.set(error=RuntimeError(
+                    "batch op not sent, the batch block raised: {}".format(
+                        h.op)))
+        self.close()
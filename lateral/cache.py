@@ -0,0 +1,207 @@
+"""
+Implements :py:class:`lateral.cache.ResponseCache`, an opt-in client side
+cache for GET requests of :py:class:`lateral.api.Request`.
+
+Entries are keyed by API url and key, endpoint and params, so APIs of
+several accounts can share a cache. They are evicted least recently used
+once their total size exceeds a bound and expire after a TTL that can be set
+per endpoint template (see :py:func:`lateral.api.endpoint_template`).
+Expired entries carrying an ETag are revalidated with `If-None-Match`.
+
+Any PUT, POST or DELETE drops the entries naming one of the ids it touches,
+e.g. `put_document('d1', ...)` drops `documents/d1`, `documents/d1/similar`
+and the `documents` listings, `post_users_preference('u1', 'd1')` drops the
+entries of user `u1` and document `d1`. `delete_all_data()` and batch
+requests with writes clear the whole cache. Entries are dropped both before
+and after the write is sent, and GETs in flight meanwhile do not store their
+responses, which may predate the write. Results merely listing a changed
+document, like the similar documents of another one, expire by TTL.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from lateral.api import endpoint_template
+
+Entry = namedtuple('Entry', 'response expires etag size tags')
+
+# nested collections naming ids of another collection
+ALIASES = {'preferences': 'documents'}
+
+# POST endpoints that do not change data
+READ_POSTS = set(['documents/similar-to-text', 'documents/popular'])
+
+ENTRY_OVERHEAD = 512    # rough size of response object and headers
+
+
+def endpoint_ids(endpoint):
+    """Set of (collection, id) pairs named by `endpoint`, e.g.
+    `users/u1/preferences/d1` names user u1 and document d1."""
+    segs = endpoint.strip('/').split('/')
+    return set((ALIASES.get(c, c), i) for c, i in zip(segs[0::2], segs[1::2]))
+
+
+def read_tags(endpoint):
+    """Ids and path an entry of `endpoint` is indexed by."""
+    return endpoint_ids(endpoint) | set([endpoint.strip('/')])
+
+
+def write_tags(endpoint):
+    """Ids and paths of the entries a write to `endpoint` affects."""
+    ids = endpoint_ids(endpoint)
+    return ids | set(c for c, _ in ids) | set([endpoint.strip('/')])
+
+
+class Reader(object):
+    """A GET in flight, stale once a write affecting it was sent."""
+    __slots__ = ('scope', 'tags', 'stale')
+
+    def __init__(self, scope, tags):
+        self.scope = scope
+        self.tags = tags
+        self.stale = False
+
+
+class ResponseCache(object):
+    """LRU cache of GET responses with TTL, size bound and hit statistics."""
+
+    def __init__(self, max_bytes=64 * 2 ** 20, ttl=60, ttls={}):
+        """
+        :param max_bytes: bound of the summed size of cached responses
+        :param ttl: seconds a response stays fresh (default 60)
+        :param ttls: dict mapping endpoint templates like
+        `documents/{id}/similar` to their own TTL
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.ttls = ttls
+        self.entries = OrderedDict()
+        self.index = {}     # (scope, tag) -> keys of the entries it names
+        self.reading = set()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evicted = 0
+        self.invalidated = 0
+        self._lock = threading.Lock()
+
+    def key(self, endpoint, params, scope=None):
+        return (scope, endpoint.strip('/'),
+                tuple(sorted((params or {}).items())))
+
+    def request(self, send, method, endpoint, params=None, data={},
+                headers=None, timeout=None, scope=None):
+        """Answer a request from the cache or by calling `send` with the
+        arguments of :py:meth:`lateral.api.Request._send`.
+        :param scope: identity of the API sending, like its url and key
+        """
+        if method != 'get':
+            if endpoint.strip('/') == 'delete-all-data':
+                drop = self.clear
+            elif endpoint.strip('/') == 'batch':
+                ops = getattr(data, 'ops', None)
+                if ops is None or any(op['method'] != 'GET' for op in ops):
+                    drop = self.clear
+                else:
+                    drop = lambda: None
+            elif endpoint.strip('/') not in READ_POSTS:
+                drop = lambda: self.invalidate(endpoint, scope)
+            else:
+                drop = lambda: None
+            drop()
+            try:
+                return send(method, endpoint, params, data, headers,
+                            timeout=timeout)
+            finally:
+                drop()  # of GETs that finished while the write was sent
+
+        key = self.key(endpoint, params, scope)
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires > now:
+                self.entries[key] = self.entries.pop(key)   # most recent
+                self.hits += 1
+                return entry.response
+            self.misses += 1
+            reader = Reader(scope, read_tags(endpoint))
+            self.reading.add(reader)
+
+        if entry is not None and entry.etag:
+            headers = dict(headers or {}, **{'If-None-Match': entry.etag})
+        try:
+            resp = send(method, endpoint, params, data, headers,
+                        timeout=timeout)
+        finally:
+            with self._lock:
+                self.reading.discard(reader)
+        if resp.status_code == 304 and entry is not None:
+            with self._lock:
+                self.revalidated += 1
+            resp = entry.response
+        if resp.status_code == 200 and not reader.stale:
+            self.store(key, resp, now + self.ttl_of(endpoint), reader)
+        return resp
+
+    def ttl_of(self, endpoint):
+        if not self.ttls:
+            return self.ttl
+        return self.ttls.get(endpoint_template(endpoint), self.ttl)
+
+    def store(self, key, resp, expires, reader=None):
+        size = len(resp.content) + ENTRY_OVERHEAD
+        entry = Entry(resp, expires, resp.headers.get('etag'), size,
+                      read_tags(key[1]))
+        with self._lock:
+            if reader is not None and reader.stale:
+                return
+            self._drop(key)
+            self.entries[key] = entry
+            self.size += size
+            for tag in entry.tags:
+                self.index.setdefault((key[0], tag), set()).add(key)
+            while self.size > self.max_bytes and self.entries:
+                self._drop(next(iter(self.entries)))
+                self.evicted += 1
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.size -= entry.size
+        for tag in entry.tags:
+            keys = self.index.get((key[0], tag))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.index[(key[0], tag)]
+        return True
+
+    def invalidate(self, endpoint, scope=None):
+        """Drop entries of API `scope` affected by a write to `endpoint`."""
+        tags = write_tags(endpoint)
+        with self._lock:
+            for reader in self.reading:
+                if reader.scope == scope and reader.tags & tags:
+                    reader.stale = True
+            for tag in tags:
+                for key in list(self.index.get((scope, tag), ())):
+                    if self._drop(key):
+                        self.invalidated += 1
+
+    def clear(self):
+        with self._lock:
+            for reader in self.reading:
+                reader.stale = True
+            self.entries.clear()
+            self.index.clear()
+            self.size = 0
+
+    def stats(self):
+        """Dict of hit, miss, revalidation, eviction and invalidation counts,
+        number of entries and their size in bytes."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'revalidated': self.revalidated, 'evicted': self.evicted,
+                    'invalidated': self.invalidated,
+                    'entries': len(self.entries), 'bytes': self.size}
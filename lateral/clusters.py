@@ -0,0 +1,118 @@
+"""
+Export of cluster models: clusters, their documents and words in one
+gzipped JSON file and the word cloud images of all clusters, all fetched
+concurrently::
+
+    model_id = api.post_cluster_model(20).json()['id']
+    wait_for_cluster_model(api, model_id)
+    export_cluster_model(api, model_id, 'model.json.gz', image_dir='clouds/')
+"""
+import gzip
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+from lateral import codec
+
+READY = ('ready', 'finished', 'done', 'completed', 'trained')
+FAILED = ('failed', 'error', 'errored', 'cancelled')
+
+
+def model_ready(model):
+    """True if the status of decoded cluster `model` is one of
+    :py:data:`READY`, False while pending, unknown or missing.
+    :raises RuntimeError: if it is one of :py:data:`FAILED`
+    """
+    status = model.get('status')
+    if status in FAILED:
+        raise RuntimeError("cluster model {} {}".format(model.get('id'),
+                                                        status))
+    return status in READY
+
+
+def wait_for_cluster_model(api, cluster_model_id, interval=1.0,
+                           max_interval=30.0, timeout=3600.0,
+                           ready=model_ready):
+    """
+    Poll `get_cluster_model` until `ready(model)` is true, doubling the
+    interval between polls up to `max_interval`.
+    :param timeout: seconds to wait at most, None for no limit
+    :param ready: function of the decoded model telling whether it is
+    ready, raising if it failed (default :py:func:`model_ready`)
+    :return: decoded cluster model
+    :raises RuntimeError: if the model failed or `timeout` seconds passed
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+        model = codec.decode(api.get_cluster_model(cluster_model_id))
+        if ready(model):
+            return model
+        if deadline is not None and time.time() + interval > deadline:
+            raise RuntimeError(
+                "cluster model {} not ready after {} s, status {}".format(
+                    cluster_model_id, timeout, model.get('status')))
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
+def cluster_ids(api, cluster_model_id):
+    """Ids of the clusters of a model."""
+    clusters = codec.decode(api.get_clusters(cluster_model_id))
+    return [c['id'] if isinstance(c, dict) else c for c in clusters]
+
+
+def word_cloud_path(prefix, cluster_id):
+    if isinstance(cluster_id, (int, long)):
+        return "{}{:02d}.png".format(prefix, cluster_id)
+    return "{}{}.png".format(prefix, cluster_id)
+
+
+def save_word_clouds(api, cluster_model_id, file_prefix, workers=8):
+    """Stream the word cloud image of every cluster to
+    `file_prefixN.png` for cluster N. Return the file names."""
+    ids = cluster_ids(api, cluster_model_id)
+    paths = [word_cloud_path(file_prefix, c) for c in ids]
+    pool = ThreadPool(workers)
+    try:
+        pool.map(lambda job: api.save_clusters_word_cloud(
+            cluster_model_id, *job), zip(ids, paths))
+    finally:
+        pool.close()
+    return paths
+
+
+def export_cluster_model(api, cluster_model_id, path, image_dir=None,
+                         workers=8):
+    """
+    Fetch documents and words of all clusters of a model, and their word
+    clouds if `image_dir` is given, with `workers` concurrent requests.
+    Write model and clusters to gzipped JSON file `path`.
+    :return: the exported dict
+    """
+    model = codec.decode(api.get_cluster_model(cluster_model_id))
+    ids = cluster_ids(api, cluster_model_id)
+    if image_dir is not None and not os.path.isdir(image_dir):
+        os.makedirs(image_dir)
+
+    def fetch(c):
+        cluster = {
+            'id': c,
+            'documents': codec.decode(
+                api.get_clusters_documents(cluster_model_id, c)),
+            'words': codec.decode(api.get_clusters_words(cluster_model_id, c)),
+        }
+        if image_dir is not None:
+            cloud = word_cloud_path(os.path.join(image_dir, ''), c)
+            api.save_clusters_word_cloud(cluster_model_id, c, cloud)
+            cluster['word_cloud'] = os.path.basename(cloud)
+        return cluster
+
+    pool = ThreadPool(workers)
+    try:
+        clusters = pool.map(fetch, ids)
+    finally:
+        pool.close()
+    result = {'model': model, 'clusters': clusters}
+    with gzip.open(path, 'wb') as f:
+        f.write(codec.dumps(result))
+    return result
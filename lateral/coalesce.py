@@ -0,0 +1,207 @@
+"""
+Implements :py:class:`lateral.coalesce.Coalescer`, which cuts the number of
+GET requests :py:class:`lateral.api.Request` sends when many threads read at
+once::
+
+    coalesce = Coalescer(batch=['documents/{id}/similar'], window=0.005)
+    api = API(key, coalesce=coalesce)
+
+Identical GETs of the same endpoint and params that overlap in time share a
+single call: the first one is sent, the others wait for its response (or
+its exception). Distinct GETs of the endpoint templates listed in `batch`
+arriving within `window` seconds of each other are sent together as the
+ops of one `/batch` request; each caller gets a response made from the
+result of its op. :py:meth:`Coalescer.stats` counts the calls saved.
+
+Calls are only shared or batched with those of APIs with the same url and
+key. Callers wait no longer than their deadline (see
+:py:meth:`lateral.api.Request.deadline`), or `max_wait` seconds without
+one, and get their own fallback when that passes.
+"""
+import threading
+import time
+
+import requests
+
+from lateral import codec
+from lateral.api import endpoint_template
+from lateral.batch import BatchOp, MAX_OPS, resolve
+from lateral.resilience import CircuitOpenError, DeadlineExceeded
+
+
+class Flight(object):
+    """A call in flight, shared by all callers asking for the same GET."""
+
+    def __init__(self):
+        self.response = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise DeadlineExceeded("shared call not answered in time")
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+def op_response(result, url):
+    """:py:class:`requests.Response` of the `result` of a batch op."""
+    resp = requests.models.Response()
+    resp.status_code = result['status']
+    resp.url = url
+    resp.headers['content-type'] = 'application/json'
+    resp.headers.update(result.get('headers') or {})
+    body = result.get('body')
+    resp._content = codec.dumps(body)
+    resp._decoded = body
+    return resp
+
+
+def reraise(e):
+    raise e
+
+
+class Coalescer(object):
+    """Share identical and batch distinct concurrent GET requests."""
+
+    def __init__(self, share=True, batch=(), window=0.002, size=MAX_OPS,
+                 max_wait=60.0):
+        """
+        :param share: True to share identical GETs of all endpoints, False
+        for none, or a collection of endpoint templates like `users/{id}`
+        :param batch: endpoint templates whose GETs are micro-batched
+        :param window: seconds a batch waits for more GETs before it is sent
+        :param size: maximum number of ops per batch request
+        :param max_wait: seconds a caller without deadline waits for a call
+        of another thread
+        """
+        self.share = share
+        self.batch = set(batch)
+        self.window = window
+        self.size = min(size, MAX_OPS)
+        self.max_wait = max_wait
+        self.flights = {}
+        self.pending = {}   # (url, key) -> [(handle, deadline)]
+        self.shared = 0
+        self.batched = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def shares(self, template):
+        if self.share is True or self.share is False:
+            return self.share
+        return template in self.share
+
+    def get(self, api, endpoint, params, call, options=(None, None)):
+        """Response of a GET of `api`, obtained by `call(options)`, from a
+        call in flight or from a batch request.
+        :param options: deadline and fallback of the caller
+        """
+        deadline, fallback = options
+        if fallback is None and api.breaker is not None:
+            fallback = api.breaker.fallback
+        try:
+            return self._get(api, endpoint, params, call, deadline)
+        except (CircuitOpenError, requests.exceptions.Timeout) as e:
+            if fallback is None:
+                raise
+            return fallback(e)
+
+    def _wait(self, deadline):
+        """Seconds to wait for a call of another thread."""
+        if deadline is None:
+            return self.max_wait
+        return max(0.0, deadline - time.time())
+
+    def _get(self, api, endpoint, params, call, deadline):
+        template = endpoint_template(endpoint)
+        if template in self.batch:
+            send = lambda: self._batched(api, endpoint, params, deadline)
+        else:   # errors go to every caller, each applying its own fallback
+            send = lambda: call((deadline, reraise))
+        if not self.shares(template):
+            return send()
+
+        key = (api.url_base, api.key, endpoint.strip('/'),
+               tuple(sorted((params or {}).items())))
+        with self._lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                self.shared += 1
+        if not leader:
+            return flight.wait(self._wait(deadline))
+        try:
+            flight.response = send()
+            return flight.response
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def _batched(self, api, endpoint, params, deadline):
+        op = {'method': 'GET', 'url': '/' + endpoint.lstrip('/')}
+        if params:
+            op['params'] = params
+        handle = BatchOp(op)
+        handle.scheduled = True     # a window or a full batch sends it
+        with self._lock:
+            pending = self.pending.setdefault((api.url_base, api.key), [])
+            pending.append((handle, deadline))
+            first = len(pending) == 1
+            full = len(pending) >= self.size
+        if full:
+            self.flush(api)
+        elif first:
+            time.sleep(self.window)
+            self.flush(api)
+        if not handle.wait(self._wait(deadline)):
+            raise DeadlineExceeded("batched call not answered in time")
+        return api._checked(op_response(handle.get(), api._url(endpoint)))
+
+    def flush(self, api):
+        """Send the pending GETs of `api` as batch requests."""
+        scope = (api.url_base, api.key)
+        while True:
+            with self._lock:
+                pending = self.pending.get(scope, [])
+                ops = pending[:self.size]
+                del pending[:self.size]
+                if not pending:
+                    self.pending.pop(scope, None)
+            if not ops:
+                return
+            self._send(api, ops)
+
+    def _send(self, api, ops):
+        handles = [h for h, _ in ops]
+        deadlines = [d for _, d in ops if d is not None]
+        body = codec.BatchBody([h.op for h in handles], api.hdr_json, False,
+                               api.compress)
+        headers = {'content-encoding': api.compress} if api.compress else None
+        try:
+            r = api._perform('post', 'batch', None, body, headers, 0.0,
+                             (min(deadlines) if deadlines else None, reraise))
+            results = codec.decode(r)['results']
+        except Exception as e:
+            for h in handles:
+                h.set(error=e)
+            return
+        with self._lock:
+            self.batched += len(handles)
+            self.batches += 1
+        resolve(handles, results)
+
+    def stats(self):
+        """Dict of shared calls, GETs sent in batches, batch requests and
+        calls saved in total."""
+        with self._lock:
+            return {'shared': self.shared, 'batched': self.batched,
+                    'batches': self.batches,
+                    'saved': self.shared + self.batched - self.batches}
@@ -0,0 +1,110 @@
+"""
+JSON codec for request bodies and responses. Uses orjson or ujson if
+installed and the standard library otherwise.
+"""
+import time
+import zlib
+
+try:
+    import orjson as impl
+except ImportError:
+    try:
+        import ujson as impl
+    except ImportError:
+        import json as impl
+
+dumps = impl.dumps
+loads = impl.loads
+
+
+def decode(resp):
+    """Decoded JSON body of response `resp`, parsed on first use only."""
+    try:
+        return resp._decoded
+    except AttributeError:
+        resp._decoded = loads(resp.content)
+        return resp._decoded
+
+
+def iter_batch(ops, headers, sequential=True):
+    """
+    Generate the parts of the body of a batch request for `ops`, dicts with
+    `method`, `url` and optional `params`. `headers` is the encoded headers
+    object shared by all ops; it is spliced into each op rather than copied
+    and encoded per op.
+    """
+    yield b'{"ops":['
+    for i, op in enumerate(ops):
+        if i:
+            yield b','
+        yield dumps(op)[:-1]
+        yield b',"headers":'
+        yield headers
+        yield b'}'
+    yield (b'],"sequential":"true"}' if sequential else
+           b'],"sequential":"false"}')
+
+
+def encode_batch(ops, headers, sequential=True):
+    """Body of a batch request as a single string, see
+    :py:func:`iter_batch`."""
+    return b''.join(iter_batch(ops, headers, sequential))
+
+
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+class BatchBody(object):
+    """
+    Body of a batch request, streamed in chunks of about `chunk_size` bytes
+    and optionally compressed with 'gzip' or 'deflate'. The body is encoded
+    anew on each iteration, so a retried request sends it again.
+    """
+
+    def __init__(self, ops, headers, sequential=True, compress=None,
+                 chunk_size=64 * 1024):
+        self.ops = ops
+        self.headers = headers
+        self.sequential = sequential
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.sent = 0
+        self.encode_time = 0.0
+
+    def __iter__(self):
+        """Chunks of the body, counting their bytes in `sent` and the
+        seconds spent encoding them in `encode_time`."""
+        self.sent = 0
+        self.encode_time = 0.0
+        chunks = self._encoded()
+        while True:
+            t0 = time.time()
+            chunk = next(chunks, None)
+            self.encode_time += time.time() - t0
+            if chunk is None:
+                return
+            self.sent += len(chunk)
+            yield chunk
+
+    def _chunks(self):
+        buf, size = [], 0
+        for part in iter_batch(self.ops, self.headers, self.sequential):
+            buf.append(part)
+            size += len(part)
+            if size >= self.chunk_size:
+                yield b''.join(buf)
+                buf, size = [], 0
+        if buf:
+            yield b''.join(buf)
+
+    def _encoded(self):
+        if self.compress is None:
+            for chunk in self._chunks():
+                yield chunk
+            return
+        z = zlib.compressobj(6, zlib.DEFLATED, WBITS[self.compress])
+        for chunk in self._chunks():
+            out = z.compress(chunk)
+            if out:
+                yield out
+        yield z.flush()
@@ -0,0 +1,151 @@
+"""
+Implements :py:class:`lateral.export.Exporter`, which snapshots an account
+into gzipped JSONL shards::
+
+    Exporter(api, 'backup/').run()
+
+Page ranges of documents, users and tags are fetched in parallel, followed
+by the preferences of all exported users and the taggings of all exported
+tags. Every shard is written to a temporary file, renamed when complete and
+then recorded in `index.json`, so an interrupted export resumes where it
+stopped when run again on the same directory. The resumed export uses the
+page size and shard sizes stored in the index, whatever it is passed.
+"""
+import gzip
+import json
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from lateral import codec
+from lateral.api import paginate
+
+COLLECTIONS = ('documents', 'users', 'tags', 'preferences', 'taggings')
+
+# parameters mapping records to shard names, recorded in the index
+LAYOUT = ('per_page', 'shard_pages', 'shard_ids')
+
+
+class Exporter(object):
+
+    def __init__(self, api, directory, per_page=100, shard_pages=20,
+                 shard_ids=100, workers=8):
+        """
+        :param api: :py:class:`lateral.api.API` of the account
+        :param directory: directory of shards and index
+        :param per_page: page size of requests
+        :param shard_pages: pages per shard of documents, users and tags
+        :param shard_ids: users or tags per shard of preferences and taggings
+        :param workers: number of shards fetched concurrently
+        """
+        self.api = api
+        self.directory = directory
+        self.per_page = per_page
+        self.shard_pages = shard_pages
+        self.shard_ids = shard_ids
+        self.workers = workers
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.index_path = os.path.join(directory, 'index.json')
+        self.index = {'shards': {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        # a resumed export keeps the shard boundaries it started with
+        for key in LAYOUT:
+            setattr(self, key, self.index.setdefault(key, getattr(self, key)))
+
+    def run(self, collections=COLLECTIONS):
+        """Export `collections` and return the index."""
+        pool = ThreadPool(self.workers)
+        try:
+            for c in collections:
+                getattr(self, 'export_' + c)(pool)
+        finally:
+            pool.close()
+            pool.join()
+        return self.index
+
+    def export_documents(self, pool):
+        self.export_pages(pool, 'documents', self.api.get_documents)
+
+    def export_users(self, pool):
+        self.export_pages(pool, 'users', self.api.get_users)
+
+    def export_tags(self, pool):
+        self.export_pages(pool, 'tags', self.api.get_tags)
+
+    def export_preferences(self, pool):
+        self.export_nested(pool, 'preferences', 'users', 'user_id',
+                           self.api.get_users_preferences)
+
+    def export_taggings(self, pool):
+        self.export_nested(pool, 'taggings', 'tags', 'tag_id',
+                           self.api.get_tags_documents)
+
+    def export_pages(self, pool, collection, get):
+        """Export paginated endpoint `get` in shards of page ranges."""
+        total = int(get(page=1, per_page=1).headers['total'])
+        pages = -(-total // self.per_page)
+        jobs = []
+        for i, first in enumerate(range(1, pages + 1, self.shard_pages)):
+            last = min(first + self.shard_pages, pages + 1)
+            fetch = lambda first=first, last=last: (
+                rec for page in range(first, last)
+                for rec in codec.decode(get(page=page,
+                                            per_page=self.per_page)))
+            jobs.append((self.shard_name(collection, i), collection, fetch))
+        self.write_shards(pool, jobs)
+
+    def export_nested(self, pool, collection, parent, key, get):
+        """Export the records `get` returns for every id of the exported
+        `parent` collection, adding the id as field `key`."""
+        ids = [rec['id'] for rec in self.records(parent)]
+        jobs = []
+        for i, first in enumerate(range(0, len(ids), self.shard_ids)):
+            group = ids[first:first + self.shard_ids]
+            fetch = lambda group=group: (
+                dict(rec, **{key: _id}) for _id in group
+                for rec in paginate(
+                    lambda page, _id=_id: get(_id, page=page,
+                                              per_page=self.per_page),
+                    self.per_page))
+            jobs.append((self.shard_name(collection, i), collection, fetch))
+        self.write_shards(pool, jobs)
+
+    def shard_name(self, collection, i):
+        return '{}-{:05d}.jsonl.gz'.format(collection, i)
+
+    def write_shards(self, pool, jobs):
+        todo = [job for job in jobs if job[0] not in self.index['shards']]
+        pool.map(self.write_shard, todo)
+
+    def write_shard(self, job):
+        name, collection, fetch = job
+        path = os.path.join(self.directory, name)
+        n = 0
+        with gzip.open(path + '.tmp', 'wb') as f:
+            for rec in fetch():
+                f.write(codec.dumps(rec))
+                f.write(b'\n')
+                n += 1
+        os.rename(path + '.tmp', path)
+        with self._lock:
+            self.index['shards'][name] = {'collection': collection,
+                                          'records': n}
+            self.save_index()
+
+    def save_index(self):
+        with open(self.index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.rename(self.index_path + '.tmp', self.index_path)
+
+    def records(self, collection):
+        """Generate the exported records of `collection` in order."""
+        names = sorted(name for name, shard in self.index['shards'].items()
+                       if shard['collection'] == collection)
+        for name in names:
+            with gzip.open(os.path.join(self.directory, name), 'rb') as f:
+                for line in f:
+                    yield codec.loads(line)
@@ -1,10 +1,42 @@
 """
-Implements subclass of :py:class:`lateral.api.Api` to send data from a csv to the Lateral Api.
+Implements subclass of :py:class:`lateral.api.Api` to send data from a csv
+to the Lateral Api.
+
+Files are streamed through :py:mod:`lateral.rows`. pandas is optional and only
+needed for :py:meth:`ApiLoader.get_df`, BeautifulSoup only for
+:py:meth:`ApiLoader.ingest_html`. Modules needed by a single method are
+imported on first use to keep importing this module cheap.
 """
-import requests, json, pandas as pd, collections
+import json, collections, itertools, time
+from multiprocessing.pool import ThreadPool
 import lateral.api
+from lateral import codec
+from lateral.batch import MAX_OPS
+from lateral.rows import read_rows, chunked, pipelined
+
+CsvDef = collections.namedtuple('CsvDef',
+                                'file textfield metafields idfield dtype')
+# documents get ids from the API, csv values stay strings
+CsvDef.__new__.__defaults__ = (None, None)
+IngestStats = collections.namedtuple('IngestStats',
+                                     'success failures seconds docs_per_s')
+DeltaStats = collections.namedtuple(
+    'DeltaStats', 'created updated deleted unchanged failed seconds')
+
+# rows of :py:func:`lateral.tools.piece_rows`
+PIECES = CsvDef(None, 'text', {'source': 'source', 'sid': 'sid', 'pos': 'pos'},
+                'id')
+
+
+def limited(batches, total):
+    """Batches of ops of the first `total` documents of `batches`, so
+    that no more are sent however many batches are in flight."""
+    for ops in batches:
+        if total <= 0:
+            return
+        yield ops[:total]
+        total -= len(ops)
 
-CsvDef = collections.namedtuple('CsvDef', 'file textfield metafields')
 
 class ApiLoader(lateral.api.Api):
     """Adds convenience functions to :py:class:`lateral.Api`."""
@@ -13,68 +45,244 @@ class ApiLoader(lateral.api.Api):
         meta = dict([(dst, row[src]) for src, dst in metafields.iteritems()])
         return meta
 
-    def create_batch_request_data(self, df, csvdef):
-        rows = [df.loc[ind] for ind in df.index]
+    def create_ops(self, rows, csvdef):
+        """Ops of a batch request posting one document per row. Rows are
+        dicts or anything else indexable by field name."""
+        url = lambda row: lateral.api.append_id(
+            '/documents', row[csvdef.idfield] if csvdef.idfield else None)
         opsdct = lambda row: {
                 'method': 'POST',
-                'url': '/documents',
+                'url': url(row),
                 'params': {'text': row[csvdef.textfield],
-                           'meta': json.dumps(
-                                self.create_meta(row, csvdef.metafields))},
-                'headers': self._hdr()
+                           'meta': codec.dumps(
+                                self.create_meta(row, csvdef.metafields))}
             }
         ops = [opsdct(row) for row in rows]
         return ops
 
+    def create_batch_request_data(self, df, csvdef):
+        return self.create_ops((df.loc[ind] for ind in df.index), csvdef)
+
     def batch_post_request(self, ops):
-        data = json.dumps({'ops': ops, 'sequential': 'true'})
-        r = requests.request(
-            'POST',
-            self._url('batch'),
-            headers=self._hdr(),
-            data=data)
-        return r
+        return self.post_batch(ops)
 
     def get_df(self, csvdef, chunksize):
+        import pandas as pd
         return pd.read_csv(csvdef.file, chunksize=chunksize, na_filter=False)
 
-    def ingest(self, csvdef, batchsize=100, total=-1):
-        """Do batch requests to load csv file. The pandas csv reader is used.
-        Be sure your csv is appropriate.
-        :param csvdef: namedtuple with filename, name of column with text content,
-        dictionary that maps column names in csv to meta field names
+    def batches(self, csvdef, batchsize):
+        """Generate the ops of one batch request per `batchsize` rows of
+        `csvdef.file`, which may be csv, json or jsonl, plain or gzipped,
+        see :py:func:`lateral.rows.read_rows` for `csvdef.dtype`."""
+        for rows in chunked(read_rows(csvdef.file, csvdef.dtype), batchsize):
+            yield self.create_ops(rows, csvdef)
+
+    def post_batches(self, batches, in_flight=1):
+        """Send batch requests, keeping up to `in_flight` of them running
+        while the next batches are built. Yield `(ops, response)` in the
+        order of `batches`."""
+        pool = ThreadPool(in_flight)
+        try:
+            for ops, r in pipelined(pool, self.batch_post_request, batches,
+                                    in_flight):
+                yield ops, r
+        finally:
+            pool.close()
+            pool.join()
+
+    def ingest(self, csvdef, batchsize=100, total=-1, in_flight=1):
+        """Do batch requests to load a csv, json or jsonl file, see
+        :py:func:`lateral.rows.read_rows`. The file is streamed.
+        :param csvdef: namedtuple with filename, name of column with text
+        content, dictionary that maps column names in csv to meta field names,
+        optionally id column and `dtype` converting csv values
         :param batchsize: size of batches (note that 100 is maximum)
         :param total: number of entries to take from csv
+        :param in_flight: number of batch requests sent concurrently
+        :return: :py:class:`IngestStats` with number of documents stored, list
+        of `(batch, doc, result)` for failed documents in order, elapsed
+        seconds and throughput
         """
+        return self.ingest_batches(self.batches(csvdef, batchsize), total,
+                                   in_flight)
+
+    def ingest_html(self, docs, length, overlap, context=0, batchsize=100,
+                    in_flight=2, processes=None):
+        """Cut html documents into pieces and store each piece as document.
+        Parsing runs in a process pool while batches are uploaded.
+        :param docs: iterable of `(name, html)`, piece ids are derived from
+        `name`, see :py:func:`lateral.tools.piece_rows`
+        :param length, overlap, context: see
+        :py:func:`lateral.tools.cut_pieces_txt`
+        :param processes: size of the parsing pool (default number of cpus)
+        :return: :py:class:`IngestStats`
+        """
+        from multiprocessing import Pool, cpu_count
+        from lateral.tools import piece_rows
+        processes = processes or cpu_count()
+        pool = Pool(processes)
+        try:
+            jobs = ((name, html, length, overlap, context)
+                    for name, html in docs)
+            parsed = pipelined(pool, piece_rows, jobs, 4 * processes)
+            rows = itertools.chain.from_iterable(r for _, r in parsed)
+            batches = (self.create_ops(chunk, PIECES)
+                       for chunk in chunked(rows, batchsize))
+            return self.ingest_batches(batches, in_flight=in_flight)
+        finally:
+            pool.terminate()
+
+    def ingest_batches(self, batches, total=-1, in_flight=1):
+        """Send ops of `batches` and collect the results, see
+        :py:meth:`ingest`."""
         success_cnt = 0
-        for i, df in enumerate(self.get_df(csvdef, batchsize)):
-            ops = self.create_batch_request_data(df, csvdef)
-            r = self.batch_post_request(ops)
-            results = dict(r.json())["results"]
+        failures = []
+        t0 = time.time()
+        if total >= 0:
+            batches = limited(batches, total)
+        batches = self.post_batches(batches, in_flight)
+        for i, (ops, r) in enumerate(batches):
+            results = codec.decode(r)["results"]
             for j, res in enumerate(results):
                 if res["status"] != 201 and res["status"] != 406:
-                    print("Error for doc {doc} in batch {bat}:\n{res}".format(
-                        doc=j, bat=i, res=json.dumps(
-                            r.json(), sort_keys=True, indent=2)))
-                    print("Document was: \n{}".format(json.dumps(ops)))
+                    failures.append((i, j, res))
+                    self.report('error', batch=i, doc=j, result=res, op=ops[j])
                 else:
                     success_cnt += 1
 
-            print("Chunk {}  status {}  {}".format(i, r.status_code, r.reason))
+            elapsed = time.time() - t0
+            self.report('batch', batch=i, status=r.status_code,
+                        reason=r.reason, success=success_cnt,
+                        docs_per_s=success_cnt / max(elapsed, 1e-9))
             if success_cnt % 500 == 0:
                 gr = self.get_documents()
-                print("{} documents total".format(gr.headers['total']))
-            if total >= 0 and success_cnt >= total:
-                break
+                self.report('total', total=int(gr.headers['total']))
+        elapsed = time.time() - t0
+        return IngestStats(success_cnt, failures, elapsed,
+                           success_cnt / elapsed if elapsed else 0.0)
+
+    def sync(self, csvdef, manifest, batchsize=100, in_flight=4):
+        """Bring the documents in the API in line with a csv or jsonl file,
+        sending only what changed since the last sync: new rows are posted,
+        changed rows put and documents of removed rows deleted. Changes are
+        detected by the hash of text and meta recorded in the manifest. A
+        sync interrupted by a crash resumes when run again.
+        :param csvdef: namedtuple as for :py:meth:`ingest`, `idfield` is
+        required
+        :param manifest: path of the SQLite manifest or a
+        :py:class:`lateral.manifest.Manifest`
+        :return: :py:class:`DeltaStats`
+        """
+        from lateral.manifest import Manifest, content_hash, _u
+        if not csvdef.idfield:
+            raise ValueError("sync needs csvdef.idfield")
+        if isinstance(manifest, basestring):
+            manifest = Manifest(manifest)
+        t0 = time.time()
+        run = manifest.begin()
+        counts = collections.Counter()
+
+        def changes():
+            for rows in chunked(read_rows(csvdef.file, csvdef.dtype),
+                                batchsize):
+                known = manifest.hashes([row[csvdef.idfield] for row in rows])
+                ops, hashes, seen = [], [], []
+                for row in rows:
+                    _id = row[csvdef.idfield]
+                    meta = self.create_meta(row, csvdef.metafields)
+                    h = content_hash(row[csvdef.textfield], meta)
+                    old = known.get(_u(_id))
+                    if old == h:
+                        seen.append(_id)
+                        continue
+                    ops.append({'method': 'POST' if old is None else 'PUT',
+                                'url': '/documents/{}'.format(_id),
+                                'params': {'text': row[csvdef.textfield],
+                                           'meta': codec.dumps(meta)}})
+                    hashes.append((_id, h))
+                manifest.mark_seen(seen, run)
+                counts['unchanged'] += len(seen)
+                if ops:
+                    yield ops, hashes
+            manifest.commit()
+
+        self._apply(changes(), manifest, run, counts, in_flight)
+        gone = manifest.unseen(run)
+        deletes = (([{'method': 'DELETE', 'url': '/documents/{}'.format(i)}
+                     for i in ids], [(i, None) for i in ids])
+                   for ids in chunked(gone, batchsize))
+        self._apply(deletes, manifest, run, counts, in_flight)
+        manifest.finish(run)
+        return DeltaStats(counts['created'], counts['updated'],
+                          counts['deleted'], counts['unchanged'],
+                          counts['failed'], time.time() - t0)
+
+    def _apply(self, jobs, manifest, run, counts, in_flight):
+        """Send `(ops, [(id, hash)])` jobs and record the successful ops in
+        the manifest, one transaction per batch. Documents whose POST finds
+        them stored already, by an interrupted run or someone else, are put
+        afterwards, since the stored copy may differ."""
+        done = {'POST': 'created', 'PUT': 'updated', 'DELETE': 'deleted'}
+        conflicts = []
+        pool = ThreadPool(in_flight)
+        try:
+            for (ops, hashes), r in pipelined(
+                    pool, lambda job: self.batch_post_request(job[0]), jobs,
+                    in_flight):
+                stored, removed, kept = [], [], []
+                for op, (_id, h), res in zip(ops, hashes,
+                                             codec.decode(r)['results']):
+                    status, method = res['status'], op['method']
+                    if method == 'POST' and status == 406:
+                        conflicts.append((dict(op, method='PUT'), (_id, h)))
+                        continue
+                    # 404: already gone
+                    if (status / 100 == 2 or
+                            (method == 'DELETE' and status == 404)):
+                        counts[done[method]] += 1
+                        if method == 'DELETE':
+                            removed.append(_id)
+                        else:
+                            stored.append((_id, h))
+                    else:
+                        counts['failed'] += 1
+                        if method == 'PUT':
+                            kept.append(_id)    # retried by the next sync
+                        self.report('error', batch=None, doc=_id, result=res,
+                                    op=op)
+                manifest.update(stored, run)
+                manifest.mark_seen(kept, run)
+                manifest.remove(removed)
+                manifest.commit()
+        finally:
+            pool.close()
+            pool.join()
+        if conflicts:
+            puts = (zip(*chunk) for chunk in chunked(conflicts, MAX_OPS))
+            self._apply(puts, manifest, run, counts, in_flight)
+
+    def report(self, event, **fields):
+        """Progress of :py:meth:`ingest_batches`, printed by default.
+        Override or replace to feed metrics or structured logs instead.
+        :param event: 'batch' after each batch request, 'error' for each
+        failed document, 'total' with the number of stored documents
+        """
+        if event == 'error':
+            print("Error for doc {doc} in batch {batch}:\n{res}".format(
+                res=json.dumps(fields['result'], sort_keys=True, indent=2),
+                **fields))
+            print("Document was: \n{}".format(json.dumps(fields['op'])))
+        elif event == 'batch':
+            print("Chunk {batch}  status {status}  {reason}  "
+                  "{docs_per_s:.0f} docs/s".format(**fields))
+        elif event == 'total':
+            print("{total} documents total".format(**fields))
 
-    def save_wordclouds(self, cluster_model_id, file_prefix):
-        """Download wordcloud images.
+    def save_wordclouds(self, cluster_model_id, file_prefix, workers=8):
+        """Download wordcloud images concurrently, streaming them to disk.
         :param cluster_model_id: cluster model id
-        :param file_prefix: images are stored to files `file_prefixN.png` for cluster N
+        :param file_prefix: images are stored to files `file_prefixN.png` for
+        cluster N
         """
-        clusters = json.loads(
-            self.get_clusters_collection(cluster_model_id).content)
-        for c in clusters:
-            r = self.get_clusters_word_cloud(cluster_model_id, c)
-            with open( "{}{:02d}.png".format(file_prefix, c), 'wb') as f:
-                f.write(r.content)
+        from lateral.clusters import save_word_clouds
+        return save_word_clouds(self, cluster_model_id, file_prefix, workers)
@@ -0,0 +1,96 @@
+"""
+Implements :py:class:`lateral.manifest.Manifest`, the SQLite file in which
+:py:meth:`lateral.loader.ApiLoader.sync` keeps the content hash of every
+document stored in the API and the sync run that last saw it.
+"""
+import hashlib
+import json
+import sqlite3
+
+MAX_VARS = 500  # ids per query, below SQLite's limit of bound variables
+
+
+def _u(s):
+    return s.decode('utf-8') if isinstance(s, str) else s
+
+
+def content_hash(text, meta):
+    """Hash of document text and meta dict."""
+    h = hashlib.sha1(_u(text).encode('utf-8'))
+    h.update(b'\0')
+    h.update(json.dumps(meta, sort_keys=True))
+    return h.hexdigest()
+
+
+class Manifest(object):
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS docs ('
+                        'id TEXT PRIMARY KEY, hash TEXT NOT NULL, '
+                        'run INTEGER NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS docs_run ON docs (run)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS state ('
+                        'key TEXT PRIMARY KEY, value)')
+        self.db.commit()
+
+    def _state(self, key, default=None):
+        row = self.db.execute('SELECT value FROM state WHERE key = ?',
+                              (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_state(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                        (key, value))
+
+    def begin(self):
+        """Number of the sync run to do: the interrupted one, if any, so that
+        documents it already stored are not sent again."""
+        run = self._state('run', 0)
+        if self._state('status') != 'running':
+            run += 1
+            self._set_state('run', run)
+            self._set_state('status', 'running')
+            self.db.commit()
+        return run
+
+    def finish(self, run):
+        self._set_state('status', 'done')
+        self.db.commit()
+
+    def hashes(self, ids):
+        """Dict of the stored hashes of those `ids` in the manifest."""
+        ids = [_u(i) for i in ids]
+        result = {}
+        for i in range(0, len(ids), MAX_VARS):
+            chunk = ids[i:i + MAX_VARS]
+            result.update(self.db.execute(
+                'SELECT id, hash FROM docs WHERE id IN ({})'.format(
+                    ','.join('?' * len(chunk))), chunk))
+        return result
+
+    def mark_seen(self, ids, run):
+        self.db.executemany('UPDATE docs SET run = ? WHERE id = ?',
+                            [(run, _u(i)) for i in ids])
+
+    def update(self, items, run):
+        """Record `(id, hash)` pairs of stored documents."""
+        self.db.executemany('INSERT OR REPLACE INTO docs VALUES (?, ?, ?)',
+                            [(_u(i), h, run) for i, h in items])
+
+    def unseen(self, run):
+        """Ids of documents not seen by sync run `run`."""
+        return [row[0] for row in self.db.execute(
+            'SELECT id FROM docs WHERE run != ?', (run,))]
+
+    def remove(self, ids):
+        self.db.executemany('DELETE FROM docs WHERE id = ?',
+                            [(_u(i),) for i in ids])
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,187 @@
+"""
+Instrumentation of :py:class:`lateral.api.Request`.
+
+Instruments passed to `Request(instruments=[...])` get the
+:py:class:`Call` of every attempt before it is sent (`before(call)`, which may
+add `call.headers`) and after it completed (`after(call)`). The encoding
+time of a call counts towards its first attempt; streamed batch bodies are
+encoded anew by every attempt, which counts that time as encoding rather
+than latency.
+
+:py:class:`Metrics` aggregates latency histograms, bytes, status codes,
+retries and encoding time per endpoint template, and exports them in the
+Prometheus text format. :py:class:`StatsdInstrument` sends the same figures
+per call to a StatsD daemon.
+"""
+import re
+import socket
+import threading
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Call(object):
+    """One attempt of an API call."""
+    __slots__ = ('method', 'endpoint', 'template', 'params', 'data',
+                 'headers', 'attempt', 'encode_time', 'timeout', 'stream',
+                 'response', 'error', 'latency')
+
+    def __init__(self, method, endpoint, template, params, data, headers,
+                 attempt, encode_time, timeout=None, stream=False):
+        self.method = method
+        self.endpoint = endpoint
+        self.template = template
+        self.params = params
+        self.data = data
+        self.headers = headers
+        self.attempt = attempt
+        self.encode_time = encode_time
+        self.timeout = timeout
+        self.stream = stream
+        self.response = None
+        self.error = None
+        self.latency = None
+
+    @property
+    def status(self):
+        return self.response.status_code if self.response is not None else None
+
+    @property
+    def body_encode_time(self):
+        """Seconds spent encoding a streamed body while it was sent."""
+        return getattr(self.data, 'encode_time', 0.0)
+
+    @property
+    def bytes_sent(self):
+        if isinstance(self.data, basestring):
+            return len(self.data)
+        return getattr(self.data, 'sent', 0)
+
+    @property
+    def bytes_received(self):
+        if self.response is None:
+            return 0
+        if self.stream:     # the body is not read yet
+            return int(self.response.headers.get('content-length') or 0)
+        return len(self.response.content)
+
+
+class EndpointStats(object):
+    __slots__ = ('count', 'buckets', 'latency_sum', 'encode_sum',
+                 'bytes_sent', 'bytes_received', 'statuses', 'retries')
+
+    def __init__(self):
+        self.count = 0
+        self.buckets = [0] * len(BUCKETS)
+        self.latency_sum = 0.0
+        self.encode_sum = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.statuses = {}
+        self.retries = 0
+
+    def add(self, call):
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if call.latency <= bound:
+                self.buckets[i] += 1
+        self.latency_sum += call.latency
+        self.encode_sum += call.encode_time
+        self.bytes_sent += call.bytes_sent
+        self.bytes_received += call.bytes_received
+        status = call.status or 'error'
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if call.attempt:
+            self.retries += 1
+
+
+def histogram(s):
+    for bound, n in zip(BUCKETS, s.buckets):
+        yield '_bucket', ',le="{}"'.format(bound), n
+    yield '_bucket', ',le="+Inf"', s.count
+    yield '_sum', '', s.latency_sum
+    yield '_count', '', s.count
+
+
+# name, type, help and samples of each metric family
+FAMILIES = [
+    ('request_seconds', 'histogram', 'Latency of API calls.', histogram),
+    ('encode_seconds_total', 'counter',
+     'Time spent encoding request bodies.',
+     lambda s: [('', '', s.encode_sum)]),
+    ('sent_bytes_total', 'counter', 'Bytes of request bodies sent.',
+     lambda s: [('', '', s.bytes_sent)]),
+    ('received_bytes_total', 'counter', 'Bytes of response bodies received.',
+     lambda s: [('', '', s.bytes_received)]),
+    ('retries_total', 'counter', 'Retried attempts of API calls.',
+     lambda s: [('', '', s.retries)]),
+    ('responses_total', 'counter', 'Responses by status code.',
+     lambda s: [('', ',status="{}"'.format(status), n)
+                for status, n in sorted(s.statuses.items())]),
+]
+
+
+class Metrics(object):
+    """Instrument aggregating :py:class:`EndpointStats` per method and
+    endpoint template."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def before(self, call):
+        pass
+
+    def after(self, call):
+        with self._lock:
+            key = (call.method, call.template)
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = EndpointStats()
+            stats.add(call)
+
+    def prometheus(self, prefix='lateral'):
+        """Metrics in the Prometheus text exposition format."""
+        with self._lock:
+            items = sorted(self.endpoints.items())
+            lines = []
+            for name, kind, text, samples in FAMILIES:
+                lines.append('# HELP {}_{} {}'.format(prefix, name, text))
+                lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+                for (method, template), s in items:
+                    lbl = 'method="{}",endpoint="{}"'.format(method, template)
+                    for suffix, extra, value in samples(s):
+                        lines.append('{}_{}{}{{{}{}}} {}'.format(
+                            prefix, name, suffix, lbl, extra, value))
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdInstrument(object):
+    """Instrument sending latency, bytes, status and retries of every call
+    to a StatsD daemon over UDP."""
+
+    def __init__(self, host='localhost', port=8125, prefix='lateral'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def name(self, call):
+        template = re.sub(r'[^a-zA-Z0-9_-]+', '_', call.template).strip('_')
+        return '{}.{}.{}'.format(self.prefix, call.method, template)
+
+    def before(self, call):
+        pass
+
+    def after(self, call):
+        name = self.name(call)
+        lines = ['{}.latency:{:.3f}|ms'.format(name, call.latency * 1000),
+                 '{}.encode:{:.3f}|ms'.format(name, call.encode_time * 1000),
+                 '{}.sent:{}|c'.format(name, call.bytes_sent),
+                 '{}.received:{}|c'.format(name, call.bytes_received),
+                 '{}.status.{}:1|c'.format(name, call.status or 'error')]
+        if call.attempt:
+            lines.append('{}.retries:1|c'.format(name))
+        try:
+            self.sock.sendto('\n'.join(lines), self.address)
+        except socket.error:
+            pass
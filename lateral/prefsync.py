@@ -0,0 +1,193 @@
+"""
+Implements :py:class:`lateral.prefsync.PreferenceSync`, which replays
+preference events in bulk::
+
+    stats = PreferenceSync(api).sync(read_rows('clicks.jsonl.gz'))
+
+Events are dicts with a user id, a document id and optionally an action,
+'add' (default) or 'delete'; the last event of a pair wins. Ids are interned
+to integers and pairs kept as sorted 64 bit keys in an `array`, so memory
+grows with the number of distinct pairs, not with the number of events.
+Pairs and interned ids are dropped once they are synced, so a long-lived
+instance can sync one log after another. The preferences of every user in
+the log are fetched from the API, by `workers` threads without further
+threads per user, and only missing ones are created and existing ones
+deleted, in concurrent batch requests.
+"""
+import collections
+import time
+from array import array
+from multiprocessing.pool import ThreadPool
+
+from lateral.rows import pipelined
+
+SyncStats = collections.namedtuple(
+    'SyncStats', 'events pairs users created deleted failed seconds')
+
+DELETE = 1
+
+
+def key_array(keys=()):
+    """Compact array of 64 bit keys, a list where longs are 32 bit."""
+    if array('L').itemsize >= 8:
+        return array('L', keys)
+    return list(keys)
+
+
+class PreferenceSync(object):
+
+    def __init__(self, api, replace=False, buffer_size=1000000, workers=8,
+                 parallel=4, max_pending=4000, user_field='user_id',
+                 document_field='document_id', action_field='action'):
+        """
+        :param api: :py:class:`lateral.api.API`
+        :param replace: also delete preferences of the users in the log that
+        no event adds
+        :param buffer_size: events buffered before they are merged
+        :param workers: number of users whose preferences are fetched
+        concurrently
+        :param parallel: number of batch requests sent concurrently
+        :param max_pending: batch ops whose results are waited for once
+        that many are unanswered
+        """
+        self.api = api
+        self.replace = replace
+        self.buffer_size = buffer_size
+        self.workers = workers
+        self.parallel = parallel
+        self.max_pending = max_pending
+        self.fields = (user_field, document_field, action_field)
+        self.reset()
+
+    def reset(self):
+        """Drop the buffered events, pairs and interned ids."""
+        self.users, self.user_ids = {}, []
+        self.docs, self.doc_ids = {}, []
+        self.keys = key_array()      # sorted pair << 1 | DELETE
+        self.buffer = key_array()    # in event order
+        self.events = 0
+
+    def _intern(self, ids, names, name):
+        i = ids.get(name)
+        if i is None:
+            i = ids[name] = len(names)
+            names.append(name)
+        return i
+
+    def add_events(self, events):
+        """Buffer `events`, merging them into the pair keys when the buffer
+        is full."""
+        user_field, document_field, action_field = self.fields
+        for e in events:
+            u = self._intern(self.users, self.user_ids, e[user_field])
+            d = self._intern(self.docs, self.doc_ids, e[document_field])
+            action = DELETE if e.get(action_field) == 'delete' else 0
+            self.buffer.append((u << 33) | (d << 1) | action)
+            self.events += 1
+            # merging costs O(pairs), so let the buffer grow with them
+            if len(self.buffer) >= max(self.buffer_size, len(self.keys) // 4):
+                self.compact()
+                self.report('events', events=self.events,
+                            pairs=len(self.keys))
+
+    def compact(self):
+        """Merge the buffer into the sorted keys, later events winning."""
+        latest = {}
+        for key in self.buffer:
+            latest[key >> 1] = key
+        new = sorted(latest.itervalues())
+        old, keys = self.keys, key_array()
+        i = j = 0
+        while i < len(old) and j < len(new):
+            a, b = old[i] >> 1, new[j] >> 1
+            if a < b:
+                keys.append(old[i])
+                i += 1
+            else:
+                keys.append(new[j])
+                j += 1
+                i += a == b
+        keys.extend(old[i:])
+        keys.extend(new[j:])
+        self.keys = keys
+        self.buffer = key_array()
+
+    def by_user(self):
+        """Generate `(user id, added document ids, deleted document ids)`."""
+        user, adds, deletes = None, [], []
+        for key in self.keys:
+            u = key >> 33
+            if u != user:
+                if user is not None:
+                    yield self.user_ids[user], adds, deletes
+                user, adds, deletes = u, [], []
+            doc = self.doc_ids[(key >> 1) & 0xffffffff]
+            (deletes if key & DELETE else adds).append(doc)
+        if user is not None:
+            yield self.user_ids[user], adds, deletes
+
+    def diff(self, job):
+        """Minimal creates and deletes of one user, given the preferences
+        stored in the API."""
+        user_id, adds, deletes = job
+        current = set(p['document_id'] for p in
+                      self.api.iter_users_preferences(user_id, prefetch=False))
+        creates = [d for d in adds if d not in current]
+        if self.replace:
+            removes = list(current.difference(adds))
+        else:
+            removes = [d for d in deletes if d in current]
+        return creates, removes
+
+    def sync(self, events=()):
+        """Add `events`, diff them against the API and send the changes.
+        :return: :py:class:`SyncStats`
+        """
+        t0 = time.time()
+        self.add_events(events)
+        self.compact()
+        self.users, self.docs = {}, {}   # only needed to intern new events
+        users = created = deleted = failed = 0
+        handles = collections.deque()
+        pool = ThreadPool(self.workers)
+        try:
+            with self.api.batch(parallel=self.parallel) as b:
+                for (user_id, _, _), (creates, removes) in pipelined(
+                        pool, self.diff, self.by_user(), 2 * self.workers):
+                    for d in creates:
+                        handles.append(b.post_users_preference(user_id, d))
+                    for d in removes:
+                        handles.append(b.delete_users_preference(user_id, d))
+                    users += 1
+                    created += len(creates)
+                    deleted += len(removes)
+                    while handles and handles[0].done():
+                        failed += self._failed(handles.popleft())
+                    if len(handles) >= self.max_pending:
+                        b.flush()
+                        while len(handles) > self.max_pending // 2:
+                            failed += self._failed(handles.popleft())
+                    if users % 1000 == 0:
+                        self.report('users', users=users, created=created,
+                                    deleted=deleted,
+                                    users_per_s=users / (time.time() - t0))
+        finally:
+            pool.close()
+        while handles:
+            failed += self._failed(handles.popleft())
+        stats = SyncStats(self.events, len(self.keys), users, created, deleted,
+                          failed, time.time() - t0)
+        self.reset()
+        return stats
+
+    def _failed(self, handle):
+        try:
+            return int(handle.get()['status'] / 100 != 2)
+        except Exception:
+            return 1
+
+    def report(self, event, **fields):
+        """Progress, printed by default. Override or replace to feed
+        metrics instead."""
+        print("{} {}".format(event, '  '.join(
+            '{}={}'.format(k, v) for k, v in sorted(fields.items()))))
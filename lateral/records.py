@@ -0,0 +1,54 @@
+"""
+Compact records for decoded API responses. Records use `__slots__`, so
+many of them take a fraction of the memory of the equivalent dicts::
+
+    docs = records(api.get_documents(per_page=100), Document)
+"""
+from lateral.codec import decode
+
+
+class Record(object):
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_dict(cls, d):
+        """Record of the known fields of dict `d`, others are dropped."""
+        rec = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(rec, name, d.get(name))
+        return rec
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(n, getattr(self, n)) for n in self.__slots__))
+
+
+class Document(Record):
+    __slots__ = ('id', 'text', 'meta', 'created_at', 'updated_at')
+
+
+class User(Record):
+    __slots__ = ('id', 'created_at', 'updated_at')
+
+
+class Recommendation(Record):
+    """Entry of similar documents and user recommendations."""
+    __slots__ = ('id', 'similarity')
+
+
+def records(resp, cls):
+    """List of `cls` records of the decoded list in response `resp`."""
+    return [cls.from_dict(d) for d in decode(resp)]
@@ -0,0 +1,294 @@
+"""
+Retries, rate limiting and adaptive concurrency for
+:py:class:`lateral.api.Request`.
+
+* :py:class:`RetryPolicy` retries throttled and failed calls with jittered
+  exponential backoff, honoring `Retry-After`.
+* :py:class:`TokenBucket` caps the request rate.
+* :py:class:`AIMDLimiter` caps the number of calls in flight, raising the cap
+  additively while calls succeed and halving it when the API throttles, so
+  it settles at the highest rate the account sustains.
+* :py:class:`Hedge` sends a duplicate of a slow GET after the 95th
+  percentile of recent latencies and takes the first answer.
+* :py:class:`CircuitBreaker` fails fast while the API keeps failing.
+
+Limiters have `acquire()` returning a token and `release(token, status)`,
+status being None if the call failed without response.
+"""
+import collections
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+THROTTLED = (429, 503)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The deadline of a call passed."""
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """The circuit breaker rejected a call."""
+
+
+def failed(status):
+    return status is None or status in THROTTLED or status >= 500
+
+
+class RetryPolicy(object):
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0,
+                 statuses=(429, 500, 502, 503, 504),
+                 methods=('get', 'put', 'delete'), post_statuses=THROTTLED):
+        """
+        :param retries: maximum number of retries per call
+        :param backoff: base delay in seconds, doubled with every retry
+        :param max_backoff: upper bound of a delay, also of `Retry-After`
+        :param statuses: status codes that are retried
+        :param methods: http methods retried on `statuses` and on connection
+        errors and timeouts
+        :param post_statuses: status codes on which POSTs not in `methods`
+        are retried, those telling that the server did not process the
+        request; other failures of a POST are not retried since it may have
+        created a document already
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+        self.methods = methods
+        self.post_statuses = post_statuses
+
+    def should_retry(self, method, attempt, resp, error):
+        if attempt >= self.retries:
+            return False
+        if method not in self.methods:
+            return (method == 'post' and resp is not None and
+                    resp.status_code in self.post_statuses)
+        if error is not None:
+            return isinstance(error, (requests.exceptions.ConnectionError,
+                                      requests.exceptions.Timeout))
+        return resp.status_code in self.statuses
+
+    def delay(self, attempt, resp=None):
+        """Seconds to wait before retry number `attempt` + 1."""
+        after = retry_after(resp) if resp is not None else None
+        if after is not None:
+            return min(after, self.max_backoff)
+        cap = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(cap / 2, cap)
+
+
+def retry_after(resp):
+    """Seconds requested by the `Retry-After` header of `resp`, if any."""
+    value = resp.headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+class TokenBucket(object):
+    """Allow `rate` calls per second on average and bursts of `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.stamp = time.time()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return None
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+    def release(self, token, status):
+        pass
+
+
+class AIMDLimiter(object):
+    """Concurrency limit with additive increase, multiplicative decrease."""
+
+    def __init__(self, initial=4, minimum=1, maximum=64, decrease=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.in_flight = 0
+        self.throttled = 0
+        self.last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            return time.time()
+
+    def release(self, token, status):
+        with self._cond:
+            self.in_flight -= 1
+            if status is None or status in THROTTLED:
+                self.throttled += 1
+                # back off once per round trip, not once per failed call
+                if token > self.last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.last_decrease = time.time()
+            elif status < 500:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class Hedge(object):
+    """Delay after which a duplicate of a GET is sent, the `quantile` of
+    the last `window` latencies of its endpoint template."""
+
+    def __init__(self, quantile=0.95, window=200, min_samples=20,
+                 initial=0.1, min_delay=0.005):
+        """
+        :param initial: delay used until `min_samples` latencies are known
+        :param min_delay: lower bound of the delay
+        """
+        self.quantile = quantile
+        self.window = window
+        self.min_samples = min_samples
+        self.initial = initial
+        self.min_delay = min_delay
+        self.latencies = {}
+        self.hedged = 0
+        self.won = 0
+        self._lock = threading.Lock()
+
+    def record(self, template, latency):
+        with self._lock:
+            lat = self.latencies.get(template)
+            if lat is None:
+                lat = self.latencies[template] = collections.deque(
+                    maxlen=self.window)
+            lat.append(latency)
+
+    def count(self, won):
+        """Count a duplicate sent and whether it answered first."""
+        with self._lock:
+            self.hedged += 1
+            self.won += won
+
+    def delay(self, template):
+        with self._lock:
+            lat = sorted(self.latencies.get(template, ()))
+        if len(lat) < self.min_samples:
+            return self.initial
+        return max(self.min_delay, lat[int(self.quantile * (len(lat) - 1))])
+
+
+class CircuitBreaker(object):
+    """Reject calls for `reset_timeout` seconds after `threshold`
+    consecutive failures, then let one trial call through; its success
+    closes the circuit again."""
+
+    def __init__(self, threshold=5, reset_timeout=30.0, fallback=None):
+        """
+        :param fallback: function of the exception returning the result of
+        calls rejected or timed out, default is to raise
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.fallback = fallback
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.trial else 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if (not self.trial and
+                    time.time() - self.opened_at >= self.reset_timeout):
+                self.trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """End an allowed call that has no status to record, so that the
+        next call can be the trial if this one was."""
+        with self._lock:
+            self.trial = False
+
+    def record(self, status):
+        with self._lock:
+            if not failed(status):
+                self.failures = 0
+                self.opened_at = None
+                self.trial = False
+                return
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at = time.time()
+                self.trial = False
+
+
+class Counters(object):
+    """Call, retry, throttle and error counts and latency of a Request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def record(self, status, latency):
+        with self._lock:
+            self.calls += 1
+            if status is None or status >= 500:
+                self.errors += 1
+            if status in THROTTLED:
+                self.throttled += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {'calls': self.calls, 'retries': self.retries,
+                    'throttled': self.throttled, 'errors': self.errors,
+                    'latency_mean': (self.latency_sum / self.calls
+                                     if self.calls else 0.0),
+                    'latency_max': self.latency_max}
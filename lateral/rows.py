@@ -0,0 +1,116 @@
+"""
+Streaming row sources for :py:mod:`lateral.loader`.
+
+Rows are read one at a time from csv or jsonl files, optionally gzipped,
+and yielded as dicts, so memory stays constant regardless of file size.
+Files holding a single JSON array are read as a whole. Note that, unlike
+the pandas reader, csv values are strings unless a `dtype` converts them.
+"""
+import collections
+import csv
+import gzip
+import itertools
+import json
+import sys
+
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+JSON_EXTENSIONS = ('.json',)
+
+# documents are text-heavy, do not choke on long csv fields
+csv.field_size_limit(sys.maxsize)
+
+
+def open_file(path):
+    """Open `path` for reading, decompressing `.gz` files on the fly."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def file_type(path):
+    """'jsonl', 'json' or 'csv', by the extension of `path`."""
+    if path.endswith('.gz'):
+        path = path[:-3]
+    if path.endswith(JSONL_EXTENSIONS):
+        return 'jsonl'
+    if path.endswith(JSON_EXTENSIONS):
+        return 'json'
+    return 'csv'
+
+
+def infer(value):
+    """`value` as int or float if it reads as one, else unchanged, much like
+    pandas infers the types of csv columns."""
+    for t in (int, float):
+        try:
+            return t(value)
+        except ValueError:
+            pass
+    return value
+
+
+def read_csv(f, dtype=None):
+    if dtype is None:
+        for row in csv.DictReader(f):
+            yield row
+        return
+    for row in csv.DictReader(f):
+        if callable(dtype):
+            yield dict((k, dtype(v)) for k, v in row.iteritems())
+        else:
+            for k, convert in dtype.iteritems():
+                row[k] = convert(row[k])
+            yield row
+
+
+def read_json(f, dtype=None):
+    for row in json.load(f):
+        yield row
+
+
+def read_jsonl(f, dtype=None):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'jsonl': read_jsonl}
+
+
+def read_rows(path, dtype=None):
+    """Generate rows of file `path` as dicts. The format is derived from the
+    file extension: `.jsonl` and `.ndjson` files hold one JSON object per
+    line, `.json` files a JSON array of objects, others are csv. `.gz` files
+    are decompressed.
+    :param dtype: for csv files, dict mapping field names to functions
+    converting their values, like `int`, or one function converting all
+    values, like :py:func:`infer` (default keep strings)
+    """
+    with open_file(path) as f:
+        for row in READERS[file_type(path)](f, dtype):
+            yield row
+
+
+def chunked(rows, size):
+    """Generate lists of up to `size` consecutive `rows`."""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def pipelined(pool, func, items, window):
+    """Apply `func` to `items` on `pool`, keeping up to `window` calls
+    running while further items are produced. Yield `(item, result)` in
+    the order of `items`."""
+    pending = collections.deque()
+    for item in items:
+        pending.append((item, pool.apply_async(func, (item,))))
+        if len(pending) >= window:
+            item, h = pending.popleft()
+            yield item, h.get()
+    while pending:
+        item, h = pending.popleft()
+        yield item, h.get()
@@ -0,0 +1,179 @@
+"""
+Implements :py:class:`lateral.sharded.ShardedAPI`, which spreads documents
+and users over several Lateral subscriptions or instances::
+
+    api = ShardedAPI({'a': API(key_a), 'b': API(key_b, url_b)})
+    api.post_document(text, meta, document_id='doc1')   # on its shard
+    api.post_documents_similar_to_text(text, k=10)      # merged top 10
+
+Ids are mapped to shards by consistent hashing, so adding a shard moves
+only about 1/n of the ids. Documents need ids to be found again. Calls
+naming a document or user id go to the shard of that id and return the
+usual response. A preference is stored on the shard of its document, so
+users are created on all shards. Queries spanning all documents or all
+preferences of a user are sent to all shards concurrently; they return
+the decoded records of all shards, merged by score for top-k queries,
+rather than a single response. The similar documents of a document are
+those similar to its text on all shards.
+"""
+import bisect
+import hashlib
+import heapq
+import itertools
+from multiprocessing.pool import ThreadPool
+
+from lateral import codec
+
+# methods routed by their first argument, a document or user id
+ROUTED = set([
+    'get_document', 'put_document', 'delete_document', 'get_documents_tags',
+    'get_documents_preferences', 'iter_documents_tags', 'iter_documents_preferences',
+    'post_documents_tagging', 'delete_documents_tagging', 'get_user',
+])
+
+# methods of a user and a document, routed by the document id
+BY_DOCUMENT = set([
+    'get_users_preference', 'post_users_preference', 'delete_users_preference',
+])
+
+
+def _point(key):
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """Consistent hashing of ids to node names."""
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.points = []
+        self.nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for r in xrange(self.replicas):
+            p = _point('{}#{}'.format(node, r))
+            bisect.insort(self.points, p)
+            self.nodes[p] = node
+
+    def remove(self, node):
+        for r in xrange(self.replicas):
+            p = _point('{}#{}'.format(node, r))
+            self.points.remove(p)
+            del self.nodes[p]
+
+    def node(self, _id):
+        if isinstance(_id, unicode):
+            _id = _id.encode('utf-8')
+        i = bisect.bisect(self.points, _point(str(_id))) % len(self.points)
+        return self.nodes[self.points[i]]
+
+
+class ShardedAPI(object):
+
+    def __init__(self, shards, replicas=100, workers=None):
+        """
+        :param shards: dict mapping shard names to :py:class:`lateral.api.API`
+        :param replicas: points per shard on the hash ring
+        :param workers: concurrent requests of fan-out calls (default one
+        per shard)
+        """
+        self.shards = dict(shards)
+        self.ring = HashRing(sorted(self.shards), replicas)
+        self.pool = ThreadPool(workers or max(len(self.shards), 1))
+
+    def add_shard(self, name, api):
+        """Add a shard. Only ids now hashed to it have to be moved there."""
+        self.shards[name] = api
+        self.ring.add(name)
+
+    def remove_shard(self, name):
+        self.ring.remove(name)
+        return self.shards.pop(name)
+
+    def shard(self, _id):
+        """API holding document or user `_id`."""
+        return self.shards[self.ring.node(_id)]
+
+    def __getattr__(self, name):
+        if name in ROUTED:
+            return lambda _id, *args, **kwargs: getattr(
+                self.shard(_id), name)(_id, *args, **kwargs)
+        if name in BY_DOCUMENT:
+            return lambda user_id, document_id: getattr(
+                self.shard(document_id), name)(user_id, document_id)
+        raise AttributeError(name)
+
+    def post_document(self, text, meta={}, document_id=None):
+        if document_id is None:
+            raise ValueError("a sharded document needs an id")
+        return self.shard(document_id).post_document(text, meta, document_id)
+
+    def post_user(self, user_id=None):
+        """Create the user on all shards, returning the response of the
+        shard of its id."""
+        if user_id is None:
+            raise ValueError("a sharded user needs an id")
+        rs = self.fan_out('post_user', user_id)
+        return rs[sorted(self.shards).index(self.ring.node(user_id))]
+
+    def delete_user(self, user_id):
+        rs = self.fan_out('delete_user', user_id)
+        return rs[sorted(self.shards).index(self.ring.node(user_id))]
+
+    def get_users_preferences(self, user_id, **params):
+        """Decoded preferences of `user_id` on all shards."""
+        return [rec for r in self.fan_out('get_users_preferences', user_id,
+                                          **params)
+                for rec in codec.decode(r)]
+
+    def iter_users_preferences(self, user_id, per_page=100, max_items=None,
+                               **params):
+        apis = [self.shards[n] for n in sorted(self.shards)]
+        recs = itertools.chain.from_iterable(
+            api.iter_users_preferences(user_id, per_page, **params)
+            for api in apis)
+        return itertools.islice(recs, max_items)
+
+    def get_user_recommendations(self, user_id, k=10, score='similarity',
+                                 **params):
+        return self.merged('get_user_recommendations', k, score, user_id,
+                           **params)
+
+    def fan_out(self, method, *args, **kwargs):
+        """Call `method` on all shards concurrently, return the responses
+        in order of the shard names."""
+        apis = [self.shards[n] for n in sorted(self.shards)]
+        return self.pool.map(
+            lambda api: getattr(api, method)(*args, **kwargs), apis)
+
+    def merged(self, method, k, score, *args, **kwargs):
+        """Top `k` records by `score` of `method` on all shards, asking each
+        shard for its top `k`."""
+        kwargs['number'] = k
+        records = (rec for r in self.fan_out(method, *args, **kwargs)
+                   for rec in codec.decode(r))
+        return heapq.nlargest(k, records, key=lambda rec: rec.get(score, 0))
+
+    def post_documents_similar_to_text(self, text, k=10, score='similarity',
+                                       **params):
+        return self.merged('post_documents_similar_to_text', k, score, text,
+                           **params)
+
+    def get_documents_similar(self, document_id, k=10, score='similarity',
+                              **params):
+        """Top `k` documents of all shards similar to the text of
+        `document_id`, the document itself excluded."""
+        doc = codec.decode(self.shard(document_id).get_document(document_id))
+        similar = self.merged('post_documents_similar_to_text', k + 1, score,
+                              doc['text'], **params)
+        return [d for d in similar if d.get('id') != document_id][:k]
+
+    def post_documents_popular(self, k=10, score='score', **params):
+        return self.merged('post_documents_popular', k, score, **params)
+
+    def close(self):
+        self.pool.close()
+        for api in self.shards.values():
+            api.close()
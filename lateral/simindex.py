@@ -0,0 +1,199 @@
+"""
+Implements :py:class:`lateral.simindex.SimilarityIndex`, a local file of the
+top-k similar documents of every document, for serving similarity lookups
+without a round trip to the API::
+
+    SimilarityIndex.build(api, 'similar.idx', k=20)
+    index = SimilarityIndex('similar.idx', api=api)
+    index.neighbours('doc1')    # [(document_id, similarity), ...]
+
+The file is memory-mapped, so any number of processes can share it. Ids are
+stored sorted and looked up by binary search; neighbours are fixed size
+records. Layout (little endian)::
+
+    header      magic 'LSIX', n ids, k (uint32 each), blob size (uint64)
+    offsets     n + 1 uint64 offsets of the ids in the blob
+    blob        utf-8 ids, sorted
+    neighbours  n * k records of id index (int32, -1 if empty) and
+                similarity (float32)
+"""
+import mmap
+import os
+import struct
+from multiprocessing.pool import ThreadPool
+
+from lateral import codec
+
+MAGIC = b'LSIX'
+HEADER = struct.Struct('<4sIIQ')
+NEIGHBOUR = struct.Struct('<if')
+
+
+def _utf8(s):
+    return s.encode('utf-8') if isinstance(s, unicode) else s
+
+
+def fetch_similar(api, document_id, k, params={}):
+    """List of up to `k` (document id, similarity) from the API."""
+    r = api.get_documents_similar(document_id, number=k, **params)
+    return [(d['id'], d['similarity']) for d in codec.decode(r)[:k]]
+
+
+def write_index(path, neighbours, k):
+    """Write dict mapping document ids to lists of (id, similarity) to
+    `path`, atomically replacing an existing file."""
+    ids = set(_utf8(i) for i in neighbours)
+    for nbs in neighbours.values():
+        ids.update(_utf8(i) for i, _ in nbs)
+    ids = sorted(ids)
+    position = dict((i, n) for n, i in enumerate(ids))
+    records = dict((_utf8(i), nbs) for i, nbs in neighbours.items())
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        blob_size = sum(len(i) for i in ids)
+        f.write(HEADER.pack(MAGIC, len(ids), k, blob_size))
+        offset = 0
+        for i in ids:
+            f.write(struct.pack('<Q', offset))
+            offset += len(i)
+        f.write(struct.pack('<Q', offset))
+        for i in ids:
+            f.write(i)
+        empty = NEIGHBOUR.pack(-1, 0.0)
+        for i in ids:
+            nbs = records.get(i, [])[:k]
+            for nid, sim in nbs:
+                f.write(NEIGHBOUR.pack(position[_utf8(nid)], sim))
+            f.write(empty * (k - len(nbs)))
+    os.rename(tmp, path)
+
+
+class SimilarityIndex(object):
+    """Read access to an index file, falling back to `api` for documents
+    missing from it."""
+
+    def __init__(self, path, api=None, **params):
+        """
+        :param path: index file written by :py:meth:`build`
+        :param api: optional :py:class:`lateral.api.API` asked on misses
+        :param params: further parameters of `get_documents_similar`
+        """
+        self.path = path
+        self.api = api
+        self.params = params
+        self.hits = 0
+        self.misses = 0
+        self.mm = None
+        self.open()
+
+    @classmethod
+    def build(cls, api, path, document_ids=None, k=10, workers=16, **params):
+        """Fetch the `k` most similar documents of `document_ids` (default
+        all documents) with `workers` concurrent requests and write the
+        index to `path`."""
+        if document_ids is None:
+            document_ids = [d['id'] for d in api.iter_documents()]
+        pool = ThreadPool(workers)
+        try:
+            neighbours = dict(pool.map(
+                lambda i: (i, fetch_similar(api, i, k, params)), document_ids))
+        finally:
+            pool.close()
+        write_index(path, neighbours, k)
+        return cls(path, api, **params)
+
+    def open(self):
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n, self.k, blob_size = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError("not a similarity index: {}".format(self.path))
+        self.offsets = HEADER.size
+        self.blob = self.offsets + 8 * (self.n + 1)
+        self.records = self.blob + blob_size
+        st = os.stat(self.path)
+        self.stamp = (st.st_ino, st.st_mtime)
+        old, self.mm = self.mm, mm
+        if old is not None:
+            old.close()
+
+    def reload(self):
+        """Map the file again if it was replaced since it was opened."""
+        st = os.stat(self.path)
+        if (st.st_ino, st.st_mtime) != self.stamp:
+            self.open()
+
+    def close(self):
+        self.mm.close()
+
+    def _id(self, n):
+        start, end = struct.unpack_from('<QQ', self.mm, self.offsets + 8 * n)
+        return self.mm[self.blob + start:self.blob + end]
+
+    def _find(self, document_id):
+        key = _utf8(document_id)
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n and self._id(lo) == key:
+            return lo
+        return None
+
+    def _neighbours(self, n):
+        result = []
+        base = self.records + n * self.k * NEIGHBOUR.size
+        for j in xrange(self.k):
+            nid, sim = NEIGHBOUR.unpack_from(self.mm,
+                                             base + j * NEIGHBOUR.size)
+            if nid < 0:
+                break
+            result.append((self._id(nid).decode('utf-8'), sim))
+        return result
+
+    def neighbours(self, document_id):
+        """List of (document id, similarity) of the most similar documents,
+        from the index or, if missing there, from the API."""
+        n = self._find(document_id)
+        if n is not None:
+            nbs = self._neighbours(n)
+            # ids only listed as neighbour of others have no record
+            if nbs or self.api is None:
+                self.hits += 1
+                return nbs
+        self.misses += 1
+        if self.api is None:
+            raise KeyError(document_id)
+        return fetch_similar(self.api, document_id, self.k, self.params)
+
+    def items(self):
+        """Generate (document id, neighbours) of all indexed documents."""
+        for n in xrange(self.n):
+            nbs = self._neighbours(n)
+            if nbs:
+                yield self._id(n).decode('utf-8'), nbs
+
+    def refresh(self, changed_ids=(), removed_ids=(), workers=16):
+        """Fetch the neighbours of `changed_ids` again, drop `removed_ids`
+        and rewrite the index. Readers keep their mapping of the old file
+        until they :py:meth:`reload`."""
+        neighbours = dict(self.items())
+        for i in removed_ids:
+            neighbours.pop(i, None)
+        removed = set(removed_ids)
+        pool = ThreadPool(workers)
+        try:
+            neighbours.update(pool.map(
+                lambda i: (i, fetch_similar(self.api, i, self.k, self.params)),
+                changed_ids))
+        finally:
+            pool.close()
+        for i, nbs in neighbours.items():
+            neighbours[i] = [(nid, sim) for nid, sim in nbs
+                             if nid not in removed]
+        write_index(self.path, neighbours, self.k)
+        self.open()
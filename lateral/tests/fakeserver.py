@@ -0,0 +1,186 @@
+"""
+Local stand-in for the Lateral API, used by tests and benchmarks.
+
+Every request is answered with a small JSON body echoing method and path,
+`/batch` requests with status 201 for each op, paths set up with
+:py:meth:`FakeServer.route` with their fixed body, and GETs of collections
+set up with :py:meth:`FakeServer.collection` with the requested page of
+their records and a `total` header. The server speaks HTTP/1.1 so
+clients can keep connections alive, and reads chunked and gzip or deflate
+compressed request bodies. The last body is kept in `last_body`. Failures
+can be injected, either queued with :py:meth:`FakeServer.inject` or at random
+with `error_rate`, and single slow answers queued with
+:py:meth:`FakeServer.stall`.
+"""
+import collections
+import json
+import random
+import threading
+import time
+import urlparse
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1   # send status, headers and body in one segment
+
+    def log_message(self, *args):
+        pass
+
+    def _raw_body(self):
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                n = int(self.rfile.readline().split(';')[0], 16)
+                if n == 0:
+                    self.rfile.readline()
+                    return ''.join(chunks)
+                chunks.append(self.rfile.read(n))
+                self.rfile.readline()
+        n = int(self.headers.get('content-length') or 0)
+        return self.rfile.read(n) if n else ''
+
+    def _body(self):
+        body = self._raw_body()
+        encoding = self.headers.get('content-encoding')
+        if encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+        self.server.last_body = body
+        return body
+
+    def _reply(self, status, body, headers={}):
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        body = self._body()
+        self.server.count()
+        delay = self.server.latency + self.server.next_stall()
+        if delay:
+            time.sleep(delay)
+        failure = self.server.next_failure()
+        if failure is not None:
+            status, headers = failure
+            self._reply(status, json.dumps({'status': status}), headers)
+            return
+        route = self.server.routes.get((self.command, self.path))
+        if route is not None:
+            self._reply(200, json.dumps(route))
+            return
+        path, _, query = self.path.partition('?')
+        records = self.server.collections.get(path.rstrip('/'))
+        if records is not None and self.command == 'GET':
+            q = urlparse.parse_qs(query)
+            page = int(q.get('page', ['1'])[0])
+            per_page = int(q.get('per_page', ['25'])[0])
+            start = (page - 1) * per_page
+            self._reply(200, json.dumps(records[start:start + per_page]),
+                        {'total': str(len(records))})
+            return
+        if self.path.rstrip('/') == '/batch':
+            ops = json.loads(body)['ops']
+            self._reply(200, json.dumps({'results': [
+                {'status': 201, 'body': {'url': op['url']}} for op in ops]}))
+            return
+        self._reply(200, json.dumps({'method': self.command,
+                                     'path': self.path}))
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    """Threaded fake Lateral server on a free local port.
+
+    Use as context manager or call :py:meth:`start` and :py:meth:`stop`.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503,
+                 handler=Handler):
+        """
+        :param latency: seconds to wait before answering
+        :param error_rate: fraction of requests answered with `error_status`
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.failures = collections.deque()
+        self.stalls = collections.deque()
+        self.routes = {}
+        self.collections = {}
+        self.requests = 0   # counted on arrival
+        self.last_body = None
+        self._lock = threading.Lock()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server_address[1])
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+    def route(self, method, path, body):
+        """Answer `method` requests of `path` with JSON `body`."""
+        self.routes[(method, path)] = body
+
+    def collection(self, path, total):
+        """Serve `total` records `{"id": ...}` paginated at `path`, e.g.
+        `/documents`."""
+        name = path.strip('/').split('/')[-1]
+        self.collections[path.rstrip('/')] = [
+            {'id': '{}{}'.format(name, i)} for i in xrange(total)]
+
+    def inject(self, status, count=1, headers={}):
+        """Answer the next `count` requests with `status` and `headers`."""
+        with self._lock:
+            self.failures.extend([(status, headers)] * count)
+
+    def stall(self, seconds, count=1):
+        """Delay the answers of the next `count` requests by `seconds`."""
+        with self._lock:
+            self.stalls.extend([seconds] * count)
+
+    def next_stall(self):
+        with self._lock:
+            return self.stalls.popleft() if self.stalls else 0.0
+
+    def next_failure(self):
+        with self._lock:
+            if self.failures:
+                return self.failures.popleft()
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status, {}
+        return None
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def request_body(request):
+    """Body of a request seen by a `responses` callback, joining streamed
+    bodies."""
+    if isinstance(request.body, (str, unicode)):
+        return request.body
+    return ''.join(request.body)
@@ -1,5 +1,6 @@
-import requests, responses, unittest, json
+import requests, responses, unittest, json, re, threading, time
 import lateral.api
+from lateral.tests.fakeserver import FakeServer
 
 class ApiTest(unittest.TestCase):
 
@@ -31,6 +32,19 @@ class ApiTest(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.api._request('get', 'http://test.io/200')
 
+    @responses.activate
+    def test_request_pool_size(self):
+        responses.add(responses.GET, 'http://test.io/documents', status=200, body=self.X)
+        self.api.get_documents()
+        unpooled = lateral.api.Api("key", url=self.url, pool_size=0)
+        assert unpooled.session is None
+        unpooled.get_documents()
+        for call in responses.calls:
+            assert call.request.headers['content-type'] == 'application/json'
+        assert responses.calls[0].request.headers['subscription-key'] == self.api.key
+        assert responses.calls[1].request.headers['subscription-key'] == "key"
+        assert self.api.counter == 1
+
     ######################
     # Documents
 
@@ -46,6 +60,60 @@ class ApiTest(unittest.TestCase):
         assert responses.calls[2].request.url.find("page=3") > 0
         assert responses.calls[2].request.url.find("per_page=5") > 0
 
+    def pages_callback(self, request):
+        page = int(re.search(r'[?&]page=(\d+)', request.url).group(1))
+        ids = range((page - 1) * 5, min(page * 5, 12))
+        return (200, {'total': '12'}, json.dumps([{"id": i} for i in ids]))
+
+    @responses.activate
+    def test_iter_documents(self):
+        responses.add_callback(responses.GET, 'http://test.io/documents',
+                               callback=self.pages_callback)
+        ids = [d["id"] for d in self.api.iter_documents(per_page=5)]
+        assert ids == range(12)
+        assert len(responses.calls) == 3
+
+    @responses.activate
+    def test_iter_documents_max_items(self):
+        responses.add_callback(responses.GET, 'http://test.io/documents',
+                               callback=self.pages_callback)
+        ids = [d["id"] for d in self.api.iter_documents(per_page=5, max_items=4)]
+        assert ids == range(4)
+        assert len(responses.calls) == 1
+
+    def test_iter_documents_fake_server(self):
+        with FakeServer() as server:
+            server.collection('/documents', 230)
+            api = lateral.api.Api("key", url=server.url)
+            ids = [d["id"] for d in api.iter_documents(per_page=50)]
+            assert ids == ['documents%d' % i for i in range(230)]
+            assert server.requests == 5
+
+    def test_iter_documents_abandoned(self):
+        with FakeServer() as server:
+            server.collection('/documents', 230)
+            api = lateral.api.Api("key", url=server.url)
+            api.get_document('d1')  # the server's thread of the connection
+            threads = set(threading.enumerate())
+            docs = api.iter_documents(per_page=50)
+            next(docs)
+            time.sleep(0.1)
+            docs.close()
+            time.sleep(0.1)
+            assert set(threading.enumerate()) <= threads
+            assert server.requests < 6
+
+    @responses.activate
+    def test_iter_documents_no_prefetch(self):
+        responses.add_callback(responses.GET, 'http://test.io/documents',
+                               callback=self.pages_callback)
+        threads = set(threading.enumerate())
+        docs = self.api.iter_documents(per_page=5, prefetch=False)
+        assert next(docs)["id"] == 0
+        assert set(threading.enumerate()) <= threads
+        assert [d["id"] for d in docs] == range(1, 12)
+        assert 'prefetch' not in responses.calls[0].request.url
+
     @responses.activate
     def test_post_document(self):
         responses.add(responses.POST, 'http://test.io/documents', status=201, body=self.X)
@@ -0,0 +1,53 @@
+import requests, responses, unittest, json
+import lateral.asyncapi
+from lateral.cache import ResponseCache
+from lateral.resilience import RetryPolicy
+
+class AsyncApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.url = "http://test.io"
+        self.api = lateral.asyncapi.AsyncAPI("009b64acf288f20816ecfbbd20000000",
+            url=self.url, concurrency=4)
+        self.X = json.dumps({"id": 1})
+
+    def tearDown(self):
+        self.api.close()
+
+    @responses.activate
+    def test_handle(self):
+        responses.add(responses.GET, 'http://test.io/documents', status=200,
+                      body=self.X, adding_headers={'total': '1'})
+        h = self.api.get_documents()
+        r = h.get()
+        assert r.json() == {"id": 1}
+        assert r.headers['total'] == '1'
+
+    @responses.activate
+    def test_handle_raises(self):
+        responses.add(responses.GET, 'http://test.io/documents/docx', status=500, body=self.X)
+        h = self.api.get_document('docx')
+        with self.assertRaises(requests.exceptions.HTTPError):
+            h.get()
+
+    @responses.activate
+    def test_fan_out(self):
+        for u in range(10):
+            responses.add(responses.GET, 'http://test.io/users/u{}/recommendations'.format(u),
+                          status=200, body=json.dumps({"id": u}))
+        rs = self.api.fan_out('get_user_recommendations', ['u{}'.format(u) for u in range(10)])
+        assert [r.json()["id"] for r in rs] == range(10)
+        assert self.api.counter == 10
+
+    @responses.activate
+    def test_request_options(self):
+        api = lateral.asyncapi.AsyncAPI("key", url=self.url, concurrency=2,
+                                        cache=ResponseCache(), timeout=5,
+                                        retry=RetryPolicy(backoff=0.01))
+        responses.add(responses.GET, 'http://test.io/documents/d1', status=503)
+        responses.add(responses.GET, 'http://test.io/documents/d1', status=200, body=self.X)
+        assert api.get_document('d1').get().status_code == 200
+        assert api.get_document('d1').get().status_code == 200
+        assert len(responses.calls) == 2
+        assert (api.timeout, api.concurrency) == (5, 2)
+        api.close()
@@ -0,0 +1,92 @@
+import requests, responses, unittest, json
+import lateral.api
+from lateral.asyncapi import AsyncAPI
+from lateral.tests.fakeserver import FakeServer, request_body
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.url = "http://test.io"
+        self.api = lateral.api.Api("009b64acf288f20816ecfbbd20000000", url=self.url)
+
+    def batch_callback(self, request):
+        ops = json.loads(request_body(request))['ops']
+        return (200, {}, json.dumps({'results': [
+            {'status': 201, 'body': {'url': op['url'], 'params': op.get('params')}}
+            for op in ops]}))
+
+    @responses.activate
+    def test_batch(self):
+        responses.add_callback(responses.POST, 'http://test.io/batch',
+                               callback=self.batch_callback)
+        with self.api.batch(size=10, parallel=2) as b:
+            hs = [b.post_users_preference('u{}'.format(i), 'd1') for i in range(25)]
+            h = b.post_document('Fat black cat', {"title": "Lorem ipsum"}, 'docx')
+            assert not h.done()
+            with self.assertRaises(RuntimeError):
+                h.get()
+        assert len(responses.calls) == 3
+        op = json.loads(request_body(responses.calls[0].request))['ops'][0]
+        assert op['headers']['subscription-key'] == self.api.key
+        assert [x.get()['body']['url'] for x in hs[:2]] == ['/users/u0/preferences/d1',
+                                                            '/users/u1/preferences/d1']
+        assert h.get()['body']['params']['text'] == 'Fat black cat'
+
+    @responses.activate
+    def test_batch_error(self):
+        responses.add(responses.POST, 'http://test.io/batch', status=500, body='')
+        with self.api.batch() as b:
+            h = b.delete_document('docx')
+        with self.assertRaises(requests.exceptions.HTTPError):
+            h.get()
+
+    @responses.activate
+    def test_batch_short_response(self):
+        responses.add(responses.POST, 'http://test.io/batch', status=200,
+                      body=json.dumps({'results': [{'status': 200, 'body': {}}]}))
+        with self.api.batch() as b:
+            hs = [b.delete_document('doc{}'.format(i)) for i in range(3)]
+        assert hs[0].get()['status'] == 200
+        with self.assertRaises(RuntimeError):
+            hs[2].get()
+
+    @responses.activate
+    def test_batch_async(self):
+        responses.add_callback(responses.POST, 'http://test.io/batch',
+                               callback=self.batch_callback)
+        api = AsyncAPI("key", url=self.url)
+        with api.batch(size=2, parallel=2) as b:
+            hs = [b.delete_document('doc{}'.format(i)) for i in range(3)]
+        assert [h.get()['body']['url'] for h in hs] == \
+            ['/documents/doc0', '/documents/doc1', '/documents/doc2']
+        api.close()
+
+    @responses.activate
+    def test_batch_block_raises(self):
+        responses.add_callback(responses.POST, 'http://test.io/batch',
+                               callback=self.batch_callback)
+        with self.assertRaises(ValueError):
+            with self.api.batch() as b:
+                h = b.delete_document('docx')
+                raise ValueError("stop")
+        assert len(responses.calls) == 0
+        with self.assertRaises(RuntimeError):
+            h.get()
+
+    def test_batch_methods(self):
+        b = self.api.batch()
+        with self.assertRaises(AttributeError):
+            b.iter_documents
+        with self.assertRaises(AttributeError):
+            b.post_batch
+        b.close()
+
+    def test_compressed_batch(self):
+        with FakeServer() as server:
+            api = lateral.api.Api("key", url=server.url, compress='gzip')
+            ops = [{'method': 'POST', 'url': '/documents',
+                    'params': {'text': 'lorem ipsum ' * 1000}}] * 50
+            r = api.post_batch(ops)
+            assert len(r.json()['results']) == 50
+            assert json.loads(server.last_body)['ops'][49]['params']['text'] == ops[0]['params']['text']
+            api.close()
@@ -0,0 +1,95 @@
+import responses, unittest, json
+import lateral.api
+from lateral.cache import ResponseCache
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.url = "http://test.io"
+        self.cache = ResponseCache(ttls={'documents/{id}/similar': 600})
+        self.api = lateral.api.Api("009b64acf288f20816ecfbbd20000000",
+            url=self.url, cache=self.cache)
+        self.X = json.dumps({"id": 1})
+
+    def test_endpoint_template(self):
+        T = lateral.api.endpoint_template
+        assert T('documents/d1/similar') == 'documents/{id}/similar'
+        assert T('documents/similar-to-text') == 'documents/similar-to-text'
+        assert T('users/u1/preferences/d1') == 'users/{id}/preferences/{document_id}'
+        assert T('unknown/x/y/z/w') == 'unknown/x/y/z/w'
+
+    @responses.activate
+    def test_hit_and_invalidate(self):
+        responses.add(responses.GET, 'http://test.io/documents/d1/similar', status=200, body=self.X)
+        responses.add(responses.GET, 'http://test.io/documents/d2/similar', status=200, body=self.X)
+        responses.add(responses.PUT, 'http://test.io/documents/d1', status=200, body=self.X)
+        self.api.get_documents_similar('d1')
+        self.api.get_documents_similar('d1')
+        self.api.get_documents_similar('d2')
+        assert len(responses.calls) == 2
+        self.api.put_document('d1', 'Fat black cat')
+        self.api.get_documents_similar('d1')
+        self.api.get_documents_similar('d2')
+        assert len(responses.calls) == 4
+        stats = self.cache.stats()
+        assert (stats['hits'], stats['misses'], stats['invalidated']) == (2, 3, 1)
+
+    @responses.activate
+    def test_delete_all_data(self):
+        responses.add(responses.GET, 'http://test.io/documents/d1', status=200, body=self.X)
+        responses.add(responses.DELETE, 'http://test.io/delete-all-data', status=200, body=self.X)
+        self.api.get_document('d1')
+        self.api.delete_all_data()
+        self.api.get_document('d1')
+        assert len(responses.calls) == 3
+        assert self.cache.stats()['entries'] == 1
+
+    @responses.activate
+    def test_revalidate(self):
+        responses.add(responses.GET, 'http://test.io/documents/d1', status=200,
+                      body=self.X, adding_headers={'etag': '"v1"'})
+        self.cache.ttl = -1
+        r1 = self.api.get_document('d1')
+        responses.reset()
+        responses.add(responses.GET, 'http://test.io/documents/d1', status=304, body='')
+        r2 = self.api.get_document('d1')
+        assert responses.calls[0].request.headers['If-None-Match'] == '"v1"'
+        assert r2.json() == {"id": 1}
+        assert self.cache.stats()['revalidated'] == 1
+
+    @responses.activate
+    def test_max_bytes(self):
+        self.cache.max_bytes = 3000
+        for i in range(10):
+            responses.add(responses.GET, 'http://test.io/documents/d{}'.format(i),
+                          status=200, body=self.X)
+            self.api.get_document('d{}'.format(i))
+        stats = self.cache.stats()
+        assert stats['bytes'] <= 3000
+        assert stats['evicted'] == 10 - stats['entries']
+
+    @responses.activate
+    def test_write_during_get(self):
+        responses.add(responses.GET, 'http://test.io/documents/d1', status=200, body=self.X)
+        responses.add(responses.PUT, 'http://test.io/documents/d1', status=200, body=self.X)
+        send = self.api._send
+
+        def slow_get(*args, **kwargs):
+            resp = send(*args, **kwargs)    # read before the write applies
+            self.cache.request(send, 'put', 'documents/d1', None, '{}',
+                               scope=('a', 'b'))
+            return resp
+        self.cache.request(slow_get, 'get', 'documents/d1', scope=('a', 'b'))
+        assert self.cache.stats()['entries'] == 0
+        self.cache.request(send, 'get', 'documents/d1', scope=('a', 'b'))
+        assert self.cache.stats()['entries'] == 1
+
+    @responses.activate
+    def test_shared_by_accounts(self):
+        responses.add(responses.GET, 'http://test.io/documents/d1', status=200, body=self.X)
+        other = lateral.api.Api("other", url=self.url, cache=self.cache)
+        self.api.get_document('d1')
+        other.get_document('d1')
+        assert len(responses.calls) == 2
+        self.api.get_document('d1')
+        assert len(responses.calls) == 2
@@ -0,0 +1,77 @@
+import responses, unittest, json, gzip, os, shutil, tempfile
+import lateral.api
+from lateral.clusters import wait_for_cluster_model, export_cluster_model
+from lateral.resilience import RetryPolicy
+
+class ClustersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.api = lateral.api.Api("009b64acf288f20816ecfbbd20000000", url="http://test.io")
+        base = 'http://test.io/cluster-models/m1'
+        responses.add(responses.GET, base + '/clusters', status=200,
+                      body=json.dumps([{'id': 0}, {'id': 1}]))
+        for c in (0, 1):
+            responses.add(responses.GET, '{}/clusters/{}/documents'.format(base, c), status=200,
+                          body=json.dumps([{'id': 'd{}'.format(c)}]))
+            responses.add(responses.GET, '{}/clusters/{}/words'.format(base, c), status=200,
+                          body=json.dumps([{'word': 'w{}'.format(c)}]))
+            responses.add(responses.GET, '{}/clusters/{}/word-cloud'.format(base, c), status=200,
+                          body='\x89PNG' + 'x' * 100000, content_type='image/png')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @responses.activate
+    def test_wait(self):
+        responses.add(responses.GET, 'http://test.io/cluster-models/m1', status=200,
+                      body=json.dumps({'id': 'm1', 'status': 'pending'}))
+        responses.add(responses.GET, 'http://test.io/cluster-models/m1', status=200,
+                      body=json.dumps({'id': 'm1', 'status': 'ready'}))
+        model = wait_for_cluster_model(self.api, 'm1', interval=0.01)
+        assert model['status'] == 'ready'
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_wait_failed(self):
+        responses.add(responses.GET, 'http://test.io/cluster-models/m1', status=200,
+                      body=json.dumps({'id': 'm1'}))
+        responses.add(responses.GET, 'http://test.io/cluster-models/m1', status=200,
+                      body=json.dumps({'id': 'm1', 'status': 'failed'}))
+        with self.assertRaises(RuntimeError):
+            wait_for_cluster_model(self.api, 'm1', interval=0.01)
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_wait_timeout(self):
+        responses.add(responses.GET, 'http://test.io/cluster-models/m1', status=200,
+                      body=json.dumps({'id': 'm1', 'status': 'renamed-state'}))
+        with self.assertRaises(RuntimeError):
+            wait_for_cluster_model(self.api, 'm1', interval=0.01, timeout=0.05)
+        model = wait_for_cluster_model(self.api, 'm1', interval=0.01,
+            ready=lambda m: m['status'] == 'renamed-state')
+        assert model['id'] == 'm1'
+
+    @responses.activate
+    def test_download_retried(self):
+        api = lateral.api.Api("key", url="http://test.io", retry=RetryPolicy(backoff=0.01))
+        url = 'http://test.io/cluster-models/m2/clusters/0/word-cloud'
+        responses.add(responses.GET, url, status=503)
+        responses.add(responses.GET, url, status=200, body='\x89PNG')
+        path = os.path.join(self.dir, 'cloud.png')
+        api.save_clusters_word_cloud('m2', 0, path)
+        assert open(path, 'rb').read() == '\x89PNG'
+        assert os.listdir(self.dir) == ['cloud.png']
+        assert api.counters.as_dict()['retries'] == 1
+
+    @responses.activate
+    def test_export(self):
+        responses.add(responses.GET, 'http://test.io/cluster-models/m1', status=200,
+                      body=json.dumps({'id': 'm1', 'status': 'ready'}))
+        path = os.path.join(self.dir, 'm1.json.gz')
+        export_cluster_model(self.api, 'm1', path, image_dir=os.path.join(self.dir, 'clouds'))
+        result = json.load(gzip.open(path))
+        assert [c['words'] for c in result['clusters']] == [[{'word': 'w0'}], [{'word': 'w1'}]]
+        cloud = os.path.join(self.dir, 'clouds', result['clusters'][1]['word_cloud'])
+        assert cloud.endswith('01.png')
+        assert os.path.getsize(cloud) == 100004
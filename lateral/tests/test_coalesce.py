@@ -0,0 +1,89 @@
+import time, unittest
+from multiprocessing.pool import ThreadPool
+import lateral.api
+from lateral import codec
+from lateral.coalesce import Coalescer, op_response
+from lateral.tests.fakeserver import FakeServer
+
+class CoalesceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer(latency=0.2).start()
+        self.pool = ThreadPool(8)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def api(self, coalesce):
+        return lateral.api.Api("key", url=self.server.url, coalesce=coalesce)
+
+    def test_share(self):
+        coalesce = Coalescer()
+        api = self.api(coalesce)
+        rs = self.pool.map(lambda i: api.get_documents_similar('d1'), range(8))
+        assert self.server.requests == 1
+        assert all(r is rs[0] for r in rs)
+        assert coalesce.stats()['shared'] == 7
+        api.get_documents_similar('d1')
+        assert self.server.requests == 2
+
+    def test_share_per_endpoint(self):
+        coalesce = Coalescer(share=['users/{id}/recommendations'])
+        api = self.api(coalesce)
+        self.pool.map(lambda i: api.get_documents_similar('d1'), range(4))
+        assert self.server.requests == 4
+        self.pool.map(lambda i: api.get_user_recommendations('u1'), range(4))
+        assert self.server.requests == 5
+
+    def test_batch(self):
+        coalesce = Coalescer(batch=['documents/{id}/similar'], window=0.1)
+        api = self.api(coalesce)
+        rs = self.pool.map(lambda i: api.get_documents_similar('d%d' % (i % 6)),
+                           range(8))
+        assert self.server.requests == 1
+        assert [codec.decode(r)['url'] for r in rs] == \
+            ['/documents/d%d/similar' % (i % 6) for i in range(8)]
+        assert coalesce.stats() == {'shared': 2, 'batched': 6, 'batches': 1,
+                                    'saved': 7}
+
+    def test_error_shared(self):
+        self.server.inject(500)
+        api = self.api(Coalescer())
+        errors = self.pool.map(lambda i: self._error(api), range(4))
+        assert all(errors)
+        assert self.server.requests == 1
+
+    def _error(self, api):
+        try:
+            api.get_documents_similar('d1')
+        except Exception as e:
+            return e
+
+    def test_per_account(self):
+        coalesce = Coalescer(batch=['documents/{id}/similar'], window=0.1)
+        apis = [self.api(coalesce),
+                lateral.api.Api("other", url=self.server.url,
+                                coalesce=coalesce)]
+        self.pool.map(lambda i: apis[i % 2].get_user_recommendations('u1'),
+                      range(4))
+        assert self.server.requests == 2
+        self.pool.map(lambda i: apis[i % 2].get_documents_similar('d%d' % i),
+                      range(4))
+        assert self.server.requests == 4
+        assert coalesce.stats()['batches'] == 2
+
+    def test_deadline(self):
+        coalesce = Coalescer(batch=['documents/{id}/similar'], window=0.01)
+        api = self.api(coalesce)
+        leader = self.pool.apply_async(api.get_user_recommendations, ('u1',))
+        time.sleep(0.05)
+        with api.deadline(0.05, fallback=lambda e: 'fallback'):
+            assert api.get_user_recommendations('u1') == 'fallback'
+            assert api.get_documents_similar('d1') == 'fallback'
+        assert leader.get().status_code == 200
+
+    def test_op_headers(self):
+        r = op_response({'status': 200, 'body': [], 'headers': {'total': '3'}},
+                        'http://test.io/documents')
+        assert (r.headers['total'], r.json()) == ('3', [])
@@ -0,0 +1,21 @@
+import unittest, json
+from lateral import codec
+from lateral.records import Document, Recommendation, records
+
+class CodecTest(unittest.TestCase):
+
+    def test_encode_batch(self):
+        ops = [{'method': 'POST', 'url': '/documents', 'params': {'text': u'caf\xe9'}},
+               {'method': 'DELETE', 'url': '/documents/x'}]
+        body = json.loads(codec.encode_batch(ops, codec.dumps({'subscription-key': 'k'}), False))
+        assert body['sequential'] == 'false'
+        assert [op['headers'] for op in body['ops']] == [{'subscription-key': 'k'}] * 2
+        assert body['ops'][0]['params']['text'] == u'caf\xe9'
+
+    def test_records(self):
+        class R(object):
+            content = '[{"id": "d1", "similarity": 0.5, "extra": 1}]'
+        r = R()
+        assert records(r, Recommendation) == [Recommendation(id='d1', similarity=0.5)]
+        assert codec.decode(r) is codec.decode(r)
+        assert Document(id='d1').as_dict()['text'] is None
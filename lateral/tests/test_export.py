@@ -0,0 +1,48 @@
+import responses, unittest, json, re, shutil, tempfile
+import lateral.api
+from lateral.export import Exporter
+
+def paged(records):
+    def callback(request):
+        page = int(re.search('[?&]page=(\d+)', request.url).group(1))
+        per_page = int(re.search('per_page=(\d+)', request.url).group(1))
+        body = records[(page - 1) * per_page:page * per_page]
+        return (200, {'total': str(len(records))}, json.dumps(body))
+    return callback
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.api = lateral.api.Api("009b64acf288f20816ecfbbd20000000", url="http://test.io")
+        docs = [{'id': 'd{}'.format(i), 'text': 'text'} for i in range(7)]
+        responses.add_callback(responses.GET, 'http://test.io/documents', callback=paged(docs))
+        responses.add_callback(responses.GET, 'http://test.io/users',
+                               callback=paged([{'id': 'u0'}, {'id': 'u1'}]))
+        responses.add_callback(responses.GET, 'http://test.io/tags', callback=paged([{'id': 't0'}]))
+        for u in ('u0', 'u1'):
+            responses.add_callback(responses.GET, 'http://test.io/users/{}/preferences'.format(u),
+                                   callback=paged([{'document_id': 'd1'}, {'document_id': 'd2'}]))
+        responses.add_callback(responses.GET, 'http://test.io/tags/t0/documents',
+                               callback=paged([{'id': 'd3'}]))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @responses.activate
+    def test_export_and_resume(self):
+        index = Exporter(self.api, self.dir, per_page=2, shard_pages=2, shard_ids=1).run()
+        assert sorted(index['shards']) == [
+            'documents-00000.jsonl.gz', 'documents-00001.jsonl.gz',
+            'preferences-00000.jsonl.gz', 'preferences-00001.jsonl.gz',
+            'taggings-00000.jsonl.gz', 'tags-00000.jsonl.gz', 'users-00000.jsonl.gz']
+        exporter = Exporter(self.api, self.dir, per_page=50, shard_pages=1, shard_ids=5)
+        assert (exporter.per_page, exporter.shard_pages, exporter.shard_ids) == (2, 2, 1)
+        assert [d['id'] for d in exporter.records('documents')] == ['d{}'.format(i) for i in range(7)]
+        assert list(exporter.records('taggings')) == [{'id': 'd3', 'tag_id': 't0'}]
+        assert len(list(exporter.records('preferences'))) == 4
+
+        n = len(responses.calls)
+        exporter.run()
+        # only the totals are requested again
+        assert len(responses.calls) == n + 3
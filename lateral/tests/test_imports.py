@@ -0,0 +1,23 @@
+import subprocess, sys, unittest
+
+HEAVY = ('pandas', 'bs4', 'sqlite3', 'multiprocessing.pool')
+
+CHECK = """import sys
+import {}
+print(' '.join(m for m in {!r} if m in sys.modules))"""
+
+class ImportTest(unittest.TestCase):
+
+    def loaded(self, module, heavy=HEAVY):
+        out = subprocess.check_output([sys.executable, '-c',
+                                       CHECK.format(module, heavy)])
+        return out.split()
+
+    def test_api(self):
+        assert self.loaded('lateral.api') == []
+
+    def test_loader(self):
+        assert self.loaded('lateral.loader', ('pandas', 'bs4', 'sqlite3')) == []
+
+    def test_tools(self):
+        assert self.loaded('lateral.tools') == []
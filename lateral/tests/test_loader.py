@@ -0,0 +1,160 @@
+import requests, responses, unittest, json, tempfile, os
+import lateral.loader, lateral.rows
+from lateral.manifest import Manifest
+from lateral.tests.fakeserver import request_body
+
+class LoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.url = "http://test.io"
+        self.loader = lateral.loader.ApiLoader("009b64acf288f20816ecfbbd20000000",
+            url=self.url)
+        fd, self.csv = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write("body,name\n")
+            for i in range(25):
+                f.write("text {0},doc{0}\n".format(i))
+        self.csvdef = lateral.loader.CsvDef(self.csv, 'body', {'name': 'title'})
+
+    def tearDown(self):
+        os.remove(self.csv)
+
+    def batch_callback(self, request):
+        ops = json.loads(request_body(request))['ops']
+        status = [406 if op['params']['text'] == 'text 7' else 201 for op in ops]
+        status[-1] = 500
+        return (200, {}, json.dumps({'results': [{'status': s} for s in status]}))
+
+    @responses.activate
+    def test_ingest_in_flight(self):
+        responses.add_callback(responses.POST, 'http://test.io/batch',
+                               callback=self.batch_callback)
+        stats = self.loader.ingest(self.csvdef, batchsize=10, in_flight=3)
+        assert len(responses.calls) == 3
+        assert stats.success == 22
+        assert [(b, d) for b, d, res in stats.failures] == [(0, 9), (1, 9), (2, 4)]
+
+    @responses.activate
+    def test_ingest_total(self):
+        responses.add_callback(responses.POST, 'http://test.io/batch',
+                               callback=self.batch_callback)
+        stats = self.loader.ingest(self.csvdef, batchsize=10, total=12,
+                                   in_flight=3)
+        assert sorted(len(json.loads(request_body(call.request))['ops'])
+                      for call in responses.calls) == [2, 10]
+        assert stats.success + len(stats.failures) == 12
+
+    def test_read_rows_jsonl_gz(self):
+        import gzip
+        fd, path = tempfile.mkstemp(suffix='.jsonl.gz')
+        os.close(fd)
+        f = gzip.open(path, 'wb')
+        for i in range(3):
+            f.write(json.dumps({'body': 'text {}'.format(i), 'name': i}) + '\n')
+        f.close()
+        csvdef = lateral.loader.CsvDef(path, 'body', {'name': 'title'})
+        ops = list(self.loader.batches(csvdef, 2))
+        os.remove(path)
+        assert [len(o) for o in ops] == [2, 1]
+        assert ops[1][0]['params']['text'] == 'text 2'
+        assert json.loads(ops[1][0]['params']['meta']) == {'title': 2}
+
+    def test_read_rows_json(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump([{'body': 'text 0', 'name': 0},
+                       {'body': 'text 1', 'name': 1}], f, indent=2)
+        csvdef = lateral.loader.CsvDef(path, 'body', {'name': 'title'})
+        ops = list(self.loader.batches(csvdef, 10))
+        os.remove(path)
+        assert [json.loads(op['params']['meta']) for op in ops[0]] == [
+            {'title': 0}, {'title': 1}]
+
+    def test_read_rows_dtype(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write("body,name,year,score\ntext,doc0,2015,0.5\n")
+        rows = list(lateral.rows.read_rows(path, {'year': int}))
+        assert rows[0]['year'] == 2015 and rows[0]['score'] == '0.5'
+        rows = list(lateral.rows.read_rows(path, lateral.rows.infer))
+        os.remove(path)
+        assert rows == [{'body': 'text', 'name': 'doc0', 'year': 2015,
+                         'score': 0.5}]
+
+    @responses.activate
+    def test_ingest_html(self):
+        responses.add_callback(responses.POST, 'http://test.io/batch',
+                               callback=self.batch_callback)
+        docs = [('doc{}'.format(i), '<p>' + 'lorem ipsum ' * 20 + '</p>') for i in range(10)]
+        stats = self.loader.ingest_html(docs, 100, 2, batchsize=10, processes=2)
+        ops = [op for call in responses.calls for op in json.loads(request_body(call.request))['ops']]
+        assert ops[0]['url'] == '/documents/doc0-0'
+        assert json.loads(ops[1]['params']['meta']) == {'source': 'doc0', 'sid': 1, 'pos': 50}
+        assert stats.success + len(stats.failures) == len(ops)
+
+    @responses.activate
+    def test_sync(self):
+        ops = []
+        def callback(request):
+            batch = json.loads(request_body(request))['ops']
+            ops.extend((op['method'], op['url']) for op in batch)
+            return (200, {}, json.dumps({'results': [{'status': 200}] * len(batch)}))
+        responses.add_callback(responses.POST, 'http://test.io/batch', callback=callback)
+        fd, manifest = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        csvdef = lateral.loader.CsvDef(self.csv, 'body', {'body': 'title'}, 'name')
+
+        stats = self.loader.sync(csvdef, manifest, batchsize=10)
+        assert (stats.created, stats.unchanged) == (25, 0)
+
+        with open(self.csv, 'w') as f:
+            f.write("body,name\n")
+            for i in range(1, 25):
+                f.write("text {0}{1},doc{0}\n".format(i, '!' if i == 3 else ''))
+            f.write("new,doc99\n")
+        del ops[:]
+        stats = self.loader.sync(csvdef, manifest, batchsize=10)
+        os.remove(manifest)
+        assert sorted(ops) == [('DELETE', '/documents/doc0'), ('POST', '/documents/doc99'),
+                               ('PUT', '/documents/doc3')]
+        assert (stats.created, stats.updated, stats.deleted, stats.unchanged) == (1, 1, 1, 23)
+
+    @responses.activate
+    def test_sync_resume(self):
+        stored, ops, sent = {}, [], [0]
+        def callback(request):
+            sent[0] += 1
+            batch = json.loads(request_body(request))['ops']
+            ops.extend((op['method'], op['url']) for op in batch)
+            results = []
+            for op in batch:
+                exists = op['url'] in stored
+                stored[op['url']] = op['params']['text']
+                results.append({'status': 406 if exists and op['method'] == 'POST' else 200})
+            if sent[0] == 2:    # stored, but the reply is lost
+                return (500, {}, '')
+            return (200, {}, json.dumps({'results': results}))
+        responses.add_callback(responses.POST, 'http://test.io/batch', callback=callback)
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        manifest = Manifest(path)
+        csvdef = lateral.loader.CsvDef(self.csv, 'body', {'body': 'title'}, 'name')
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.loader.sync(csvdef, manifest, batchsize=10, in_flight=1)
+        assert (manifest._state('run'), manifest._state('status')) == (1, 'running')
+
+        with open(self.csv, 'w') as f:
+            f.write("body,name\n")
+            for i in range(25):
+                f.write("text {0}{1},doc{0}\n".format(i, '!' if i == 3 else ''))
+        del ops[:]
+        stats = self.loader.sync(csvdef, manifest, batchsize=10, in_flight=1)
+        assert (manifest._state('run'), manifest._state('status')) == (1, 'done')
+        assert [url for m, url in ops if m == 'POST'] == \
+            ['/documents/doc%d' % i for i in range(10, 25)]
+        assert sorted(url for m, url in ops if m == 'PUT') == \
+            sorted('/documents/doc%d' % i for i in [3] + range(10, 20))
+        assert stored['/documents/doc3'] == 'text 3!'
+        assert (stats.created, stats.updated, stats.unchanged) == (5, 11, 9)
+        manifest.close()
+        os.remove(path)
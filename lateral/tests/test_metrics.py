@@ -0,0 +1,67 @@
+import responses, unittest, json, socket
+import lateral.api
+from lateral import codec
+from lateral.metrics import Metrics, StatsdInstrument
+from lateral.resilience import RetryPolicy
+from lateral.tests.fakeserver import FakeServer
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.api = lateral.api.Api("009b64acf288f20816ecfbbd20000000",
+            url="http://test.io", instruments=[self.metrics])
+        self.X = json.dumps({"id": 1})
+
+    @responses.activate
+    def test_metrics(self):
+        responses.add(responses.GET, 'http://test.io/documents/d1/similar', status=200, body=self.X)
+        responses.add(responses.GET, 'http://test.io/documents/d2/similar', status=200, body=self.X)
+        responses.add(responses.POST, 'http://test.io/documents/similar-to-text', status=200, body=self.X)
+        self.api.get_documents_similar('d1')
+        self.api.get_documents_similar('d2')
+        self.api.post_documents_similar_to_text('Fat black cat')
+        s = self.metrics.endpoints[('get', 'documents/{id}/similar')]
+        assert (s.count, s.statuses, s.bytes_received) == (2, {200: 2}, 2 * len(self.X))
+        s = self.metrics.endpoints[('post', 'documents/similar-to-text')]
+        assert s.bytes_sent == len(codec.dumps({"text": "Fat black cat"}))
+        text = self.metrics.prometheus()
+        assert 'lateral_request_seconds_count{method="get",endpoint="documents/{id}/similar"} 2' in text
+        assert 'lateral_responses_total{method="get",endpoint="documents/{id}/similar",status="200"} 2' in text
+        lines = text.splitlines()
+        i = lines.index('# TYPE lateral_request_seconds histogram')
+        assert lines[i - 1].startswith('# HELP lateral_request_seconds ')
+        assert lines[i + 1].startswith('lateral_request_seconds_bucket{')
+        assert '# TYPE lateral_responses_total counter' in lines
+
+    @responses.activate
+    def test_encode_time(self):
+        api = lateral.api.Api("key", url="http://test.io", instruments=[self.metrics],
+                              retry=RetryPolicy(backoff=0.001))
+        responses.add(responses.PUT, 'http://test.io/documents/d1', status=503)
+        responses.add(responses.PUT, 'http://test.io/documents/d1', status=200, body=self.X)
+        api._local.encode_time = 1.0
+        api.put_document('d1', 'Fat black cat')
+        s = self.metrics.endpoints[('put', 'documents/{id}')]
+        assert (s.count, s.retries) == (2, 1)
+        assert 1.0 <= s.encode_sum < 1.1
+
+    def test_batch_encode_time(self):
+        with FakeServer() as server:
+            api = lateral.api.Api("key", url=server.url, instruments=[self.metrics])
+            api.post_batch([{'method': 'GET', 'url': '/documents/d%d' % i}
+                            for i in range(10000)])
+            api.close()
+        s = self.metrics.endpoints[('post', 'batch')]
+        assert s.encode_sum > 0 and s.bytes_sent > 10000
+
+    @responses.activate
+    def test_statsd(self):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(('127.0.0.1', 0))
+        api = lateral.api.Api("key", url="http://test.io",
+            instruments=[StatsdInstrument('127.0.0.1', sink.getsockname()[1])])
+        responses.add(responses.GET, 'http://test.io/users/u1/recommendations', status=200, body=self.X)
+        api.get_user_recommendations('u1')
+        lines = sink.recv(4096).split('\n')
+        assert 'lateral.get.users_id_recommendations.status.200:1|c' in lines
@@ -0,0 +1,37 @@
+import responses, unittest, json
+import lateral.api
+from lateral.prefsync import PreferenceSync
+from lateral.tests.fakeserver import request_body
+
+class PreferenceSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = lateral.api.Api("009b64acf288f20816ecfbbd20000000", url="http://test.io")
+        self.ops = []
+
+    def batch_callback(self, request):
+        ops = json.loads(request_body(request))['ops']
+        self.ops.extend((op['method'], op['url']) for op in ops)
+        return (200, {}, json.dumps({'results': [{'status': 201}] * len(ops)}))
+
+    @responses.activate
+    def test_sync(self):
+        responses.add(responses.GET, 'http://test.io/users/u1/preferences', status=200,
+                      body=json.dumps([{'document_id': 'd1'}, {'document_id': 'd2'}]))
+        responses.add(responses.GET, 'http://test.io/users/u2/preferences', status=200,
+                      body=json.dumps([]))
+        responses.add_callback(responses.POST, 'http://test.io/batch', callback=self.batch_callback)
+        events = [{'user_id': 'u1', 'document_id': 'd1'},
+                  {'user_id': 'u2', 'document_id': 'd4', 'action': 'delete'},
+                  {'user_id': 'u1', 'document_id': 'd3'},
+                  {'user_id': 'u1', 'document_id': 'd2', 'action': 'delete'},
+                  {'user_id': 'u1', 'document_id': 'd3'},
+                  {'user_id': 'u2', 'document_id': 'd4'}] * 3
+        sync = PreferenceSync(self.api, buffer_size=4, max_pending=2)
+        stats = sync.sync(events)
+        assert sorted(self.ops) == [('DELETE', '/users/u1/preferences/d2'),
+                                    ('POST', '/users/u1/preferences/d3'),
+                                    ('POST', '/users/u2/preferences/d4')]
+        assert (stats.events, stats.pairs, stats.users) == (18, 4, 2)
+        assert (stats.created, stats.deleted, stats.failed) == (2, 1, 0)
+        assert (sync.user_ids, sync.doc_ids, len(sync.keys)) == ([], [], 0)
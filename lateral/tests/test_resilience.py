@@ -0,0 +1,183 @@
+import requests, unittest, time
+from multiprocessing.pool import ThreadPool
+import lateral.api
+from lateral.resilience import (RetryPolicy, TokenBucket, AIMDLimiter,
+    retry_after, Hedge, CircuitBreaker, CircuitOpenError, DeadlineExceeded)
+from lateral.tests.fakeserver import FakeServer
+
+class ResilienceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer().start()
+        self.retry = RetryPolicy(retries=3, backoff=0.01)
+        self.api = lateral.api.Api("key", url=self.server.url, retry=self.retry)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def test_retry(self):
+        self.server.inject(503, 2)
+        r = self.api.get_documents()
+        assert r.status_code == 200
+        assert self.server.requests == 3
+        c = self.api.counters.as_dict()
+        assert (c['calls'], c['retries'], c['throttled']) == (3, 2, 2)
+
+    def test_retry_exhausted(self):
+        self.server.inject(500, 4)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.api.get_documents()
+        assert self.server.requests == 4
+
+    def test_retry_post(self):
+        self.server.inject(500)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.api.post_document('text')
+        assert self.server.requests == 1
+        self.server.inject(503, 2)
+        assert self.api.post_document('text').status_code == 200
+        assert self.server.requests == 4
+
+    def test_retry_after(self):
+        self.server.inject(429, 1, {'Retry-After': '0.2'})
+        t0 = time.time()
+        self.api.get_documents()
+        assert time.time() - t0 >= 0.2
+
+    def test_retry_after_date(self):
+        class R(object):
+            headers = {'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        assert retry_after(R()) == 0.0
+        assert self.retry.delay(5) <= 0.32
+
+    def test_token_bucket(self):
+        api = lateral.api.Api("key", url=self.server.url,
+                              limiters=[TokenBucket(rate=50, burst=1)])
+        t0 = time.time()
+        for _ in range(11):
+            api.get_documents()
+        assert time.time() - t0 >= 0.2
+
+    def test_aimd(self):
+        aimd = AIMDLimiter(initial=8, maximum=16)
+        api = lateral.api.Api("key", url=self.server.url,
+                              retry=RetryPolicy(retries=20, backoff=0.001),
+                              limiters=[aimd])
+        self.server.error_rate = 0.2
+        ThreadPool(16).map(lambda i: api.get_document(str(i)), range(200))
+        assert aimd.throttled > 0
+        assert 1 <= aimd.limit <= 16
+        assert aimd.in_flight == 0
+
+    def test_timeout(self):
+        api = lateral.api.Api("key", url=self.server.url, timeout=5,
+                              timeouts={'documents': 0.05})
+        self.server.stall(0.3)
+        with self.assertRaises(requests.exceptions.Timeout):
+            api.get_documents()
+        self.server.stall(0.1)
+        assert api.get_document('1').status_code == 200
+
+    def test_deadline(self):
+        self.server.inject(503, 10)
+        t0 = time.time()
+        with self.assertRaises(requests.exceptions.HTTPError):
+            with self.api.deadline(0.015):
+                self.api.get_documents()
+        assert time.time() - t0 < 0.015 + 0.2
+        assert self.server.requests < 4
+        self.server.stall(0.3)
+        with self.api.deadline(0.05, fallback=lambda e: e):
+            e = self.api.get_documents()
+        assert isinstance(e, requests.exceptions.Timeout)
+        with self.assertRaises(DeadlineExceeded):
+            with self.api.deadline(0):
+                self.api.get_documents()
+
+    def test_hedge(self):
+        hedge = Hedge(initial=0.05)
+        api = lateral.api.Api("key", url=self.server.url, hedge=hedge)
+        self.server.stall(0.5)
+        t0 = time.time()
+        assert api.get_documents().status_code == 200
+        assert time.time() - t0 < 0.4
+        assert (hedge.hedged, hedge.won) == (1, 1)
+        assert self.server.requests == 2
+        api.post_document('text')
+        assert hedge.hedged == 1
+        api.close()
+
+    def test_hedge_error(self):
+        class Broken(object):
+            def before(self, call):
+                raise ValueError("broken instrument")
+        api = lateral.api.Api("key", url=self.server.url, hedge=Hedge(),
+                              instruments=[Broken()])
+        with self.assertRaises(ValueError):
+            api.get_documents()
+        api.close()
+
+    def test_hedge_delay(self):
+        hedge = Hedge(quantile=0.5, min_samples=3, initial=1.0)
+        assert hedge.delay('documents') == 1.0
+        for latency in (0.01, 0.02, 0.03):
+            hedge.record('documents', latency)
+        assert hedge.delay('documents') == 0.02
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=0.1)
+        api = lateral.api.Api("key", url=self.server.url, breaker=breaker,
+                              ignore=[406, 503])
+        self.server.inject(503, 3)
+        api.get_documents()
+        api.get_documents()
+        assert breaker.state == 'open'
+        with self.assertRaises(CircuitOpenError):
+            api.get_documents()
+        assert (self.server.requests, breaker.rejected) == (2, 1)
+        time.sleep(0.1)
+        api.get_documents()
+        assert breaker.state == 'open'
+        time.sleep(0.1)
+        assert api.get_documents().status_code == 200
+        assert breaker.state == 'closed'
+
+    def test_circuit_breaker_deadline(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+        api = lateral.api.Api("key", url=self.server.url, breaker=breaker,
+                              ignore=[406, 503])
+        self.server.inject(503)
+        api.get_documents()
+        assert breaker.state == 'open'
+        time.sleep(0.05)
+        with self.assertRaises(DeadlineExceeded):
+            with api.deadline(0):
+                api.get_documents()
+        assert breaker.state == 'open'
+        assert api.get_documents().status_code == 200
+        assert breaker.state == 'closed'
+
+    def test_circuit_breaker_release(self):
+        class Broken(object):
+            def before(self, call):
+                raise ValueError("broken instrument")
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+        api = lateral.api.Api("key", url=self.server.url, breaker=breaker,
+                              ignore=[406, 503], instruments=[Broken()])
+        breaker.record(None)
+        time.sleep(0.05)
+        with self.assertRaises(ValueError):
+            api.get_documents()
+        assert breaker.state == 'open'
+        api.instruments = []
+        assert api.get_documents().status_code == 200
+        assert breaker.state == 'closed'
+
+    def test_circuit_breaker_fallback(self):
+        breaker = CircuitBreaker(threshold=1, fallback=lambda e: None)
+        api = lateral.api.Api("key", url=self.server.url, breaker=breaker,
+                              ignore=[406, 500])
+        self.server.inject(500)
+        api.get_documents()
+        assert api.get_documents() is None
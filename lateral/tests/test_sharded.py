@@ -0,0 +1,72 @@
+import unittest, json
+import lateral.api
+from lateral.sharded import ShardedAPI, HashRing
+from lateral.tests.fakeserver import FakeServer
+
+class ShardedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = dict((name, FakeServer().start()) for name in 'abc')
+        self.api = ShardedAPI(dict((name, lateral.api.Api("key", url=s.url))
+                                   for name, s in self.servers.items()))
+
+    def tearDown(self):
+        self.api.close()
+        for s in self.servers.values():
+            s.stop()
+
+    def test_ring(self):
+        ids = ['doc{}'.format(i) for i in range(2000)]
+        ring = HashRing('abc')
+        before = dict((i, ring.node(i)) for i in ids)
+        assert set(before.values()) == set('abc')
+        ring.add('d')
+        moved = [i for i in ids if ring.node(i) != before[i]]
+        assert all(ring.node(i) == 'd' for i in moved)
+        assert 250 < len(moved) < 750
+
+    def test_routing(self):
+        r = self.api.get_documents_tags('doc7')
+        name = self.api.ring.node('doc7')
+        assert r.json() == {'method': 'GET', 'path': '/documents/doc7/tags'}
+        assert [s.requests for n, s in sorted(self.servers.items())] == \
+            [int(n == name) for n in 'abc']
+
+    def test_merged(self):
+        for i, s in enumerate(self.servers.values()):
+            s.route('POST', '/documents/similar-to-text',
+                    [{'id': 'd{}{}'.format(i, j), 'similarity': (i + 3 * j) / 10.}
+                     for j in range(3)])
+        top = self.api.post_documents_similar_to_text('Fat black cat', k=4)
+        assert [d['similarity'] for d in top] == [0.8, 0.7, 0.6, 0.5]
+        for s in self.servers.values():
+            assert json.loads(s.last_body)['number'] == 4
+
+    def test_similar(self):
+        name = self.api.ring.node('d00')
+        self.servers[name].route('GET', '/documents/d00',
+                                 {'id': 'd00', 'text': 'Fat black cat'})
+        for i, s in enumerate(self.servers.values()):
+            s.route('POST', '/documents/similar-to-text',
+                    [{'id': 'd{}{}'.format(i, j), 'similarity': (i + 3 * j) / 10.}
+                     for j in range(3)])
+        similar = self.api.get_documents_similar('d00', k=2)
+        assert [d['similarity'] for d in similar] == [0.8, 0.7]
+        for s in self.servers.values():
+            body = json.loads(s.last_body)
+            assert (body['text'], body['number']) == ('Fat black cat', 3)
+
+    def test_document_needs_id(self):
+        with self.assertRaises(ValueError):
+            self.api.post_document('Fat black cat')
+        self.api.post_document('Fat black cat', document_id='doc7')
+        self.api.get_document('doc7')
+        name = self.api.ring.node('doc7')
+        assert self.servers[name].requests == 2
+
+    def test_preference(self):
+        self.api.post_user('user1')
+        assert [s.requests for s in self.servers.values()] == [1, 1, 1]
+        r = self.api.post_users_preference('user1', 'doc7')
+        assert r.json()['path'] == '/users/user1/preferences/doc7'
+        assert self.servers[self.api.ring.node('doc7')].requests == 2
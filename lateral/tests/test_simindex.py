@@ -0,0 +1,36 @@
+import responses, unittest, json, os, re, tempfile
+import lateral.api
+from lateral.simindex import SimilarityIndex
+
+def similar(request):
+    doc = int(re.search('documents/d(\d+)/similar', request.url).group(1))
+    return (200, {}, json.dumps([{'id': 'd{}'.format(doc + j), 'similarity': 1.0 / j}
+                                 for j in range(1, 4)]))
+
+class SimilarityIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.api = lateral.api.Api("009b64acf288f20816ecfbbd20000000", url="http://test.io")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    @responses.activate
+    def test_build_lookup_refresh(self):
+        responses.add_callback(responses.GET, re.compile('http://test.io/documents/d\d+/similar'),
+                               callback=similar)
+        index = SimilarityIndex.build(self.api, self.path, ['d1', 'd2', 'd10'], k=2, workers=2)
+        assert index.neighbours('d10') == [('d11', 1.0), ('d12', 0.5)]
+        n = len(responses.calls)
+        assert index.neighbours('d7') == [('d8', 1.0), ('d9', 0.5)]   # fallback to the API
+        assert (index.hits, index.misses, len(responses.calls)) == (1, 1, n + 1)
+
+        reader = SimilarityIndex(self.path)
+        index.refresh(changed_ids=['d7'], removed_ids=['d2'])
+        reader.reload()
+        assert reader.neighbours('d7') == [('d8', 1.0), ('d9', 0.5)]
+        assert reader.neighbours('d1') == [('d3', 0.5)]
+        with self.assertRaises(KeyError):
+            reader.neighbours('d2')
@@ -0,0 +1,47 @@
+import unittest, random, tempfile, os
+from lateral import tools
+from lateral.tools import Piece
+
+def reference_pieces(text, length, overlap, context=0):
+    """chunk joining implementation cut_pieces_txt has to agree with"""
+    ch_len = int(round(length/overlap))
+    text_chunks = [text[i:i + ch_len] for i in xrange(0, len(text), ch_len)]
+    n_chunks = len(text_chunks)
+    for i_ch in range(n_chunks + 1 - overlap):
+        content = ''.join(text_chunks[i_ch:min(i_ch + overlap, n_chunks)])
+        head = ''.join(text_chunks[max(i_ch - context, 0):i_ch])
+        tail = ''.join(text_chunks[i_ch:min(i_ch + overlap + context, n_chunks)])
+        yield Piece(content, head, tail, sid=i_ch, pos=i_ch * ch_len)
+
+class ToolsTest(unittest.TestCase):
+
+    def test_cut_pieces_txt(self):
+        rnd = random.Random(0)
+        for _ in range(500):
+            text = ''.join(rnd.choice('ab ') for _ in range(rnd.randint(0, 200)))
+            length = rnd.randint(1, 40)
+            overlap, context = rnd.randint(1, length), rnd.randint(0, 3)
+            assert list(tools.cut_pieces_txt(text, length, overlap, context)) == \
+                list(reference_pieces(text, length, overlap, context))
+
+    def test_cut_pieces_many(self):
+        views = tools.cut_pieces_many(['abcdef', 'xyzuvw', 'ab'], 4, 2)
+        assert [[v.content for v in vs] for vs in views] == \
+            [['abcd', 'cdef'], ['xyzu', 'zuvw'], []]
+
+    def test_mapped_file(self):
+        text = 'hello world ' * 100
+        fd, path = tempfile.mkstemp()
+        os.write(fd, text)
+        os.close(fd)
+        with tools.mapped_file(path) as m:
+            pieces = [v.piece() for v in tools.cut_views(m, 30, 3, 1)]
+        os.remove(path)
+        assert pieces == list(reference_pieces(text, 30, 3, 1))
+
+    def test_piece_rows(self):
+        html = '<html><body><h1>Title</h1><p>' + 'word ' * 40 + '</p></body></html>'
+        rows = tools.piece_rows(('My Page.html', html, 60, 2, 0))
+        assert [r['id'] for r in rows[:2]] == ['my_page-html-0', 'my_page-html-1']
+        assert rows[1]['pos'] == 30
+        assert rows[0]['text'].startswith('Title')
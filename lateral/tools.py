@@ -1,12 +1,29 @@
+import mmap
 import re
 from collections import namedtuple
-from bs4 import BeautifulSoup
+from contextlib import contextmanager
 
 Piece = namedtuple('Piece', "content head tail sid pos")
 
 def cut_pieces_html(soup, length, overlap, context):
     return cut_pieces_txt(soup.text, length, overlap, context)
 
+def piece_rows(job):
+    """
+    Parse html and cut it into pieces, for use in a process pool.
+    :param job: tuple `(name, html, length, overlap, context)`
+    :return: list of dicts with `id` (:py:func:`idlize` of `name` plus the
+    piece's `sid`), `text`, `source`, `sid` and `pos`
+    """
+    from bs4 import BeautifulSoup   # optional, see setup.py extras
+    name, html, length, overlap, context = job
+    soup = BeautifulSoup(html, 'html.parser')
+    prefix = idlize(name)
+    return [{'id': '{}-{}'.format(prefix, p.sid), 'text': p.content,
+             'source': name, 'sid': p.sid, 'pos': p.pos}
+            for p in cut_pieces_html(soup, length, overlap, context)]
+
+
 def cut_pieces_txt(text, length, overlap, context=0):
     """
     cut `text` into chunks of length `length`/`overlap` and recombine them
@@ -14,15 +31,99 @@ def cut_pieces_txt(text, length, overlap, context=0):
     `text` be overlapped by `overlap` pieces. Keep `context` chunks as head
     and tail of piece.
     """
+    for view in cut_views(text, length, overlap, context):
+        yield view.piece()
+
+
+def chunk_length(length, overlap):
     ch_len = int(round(length/overlap))
-    text_chunks = [text[i:i + ch_len] for i in xrange(0, len(text), ch_len)]
-    n_chunks = len(text_chunks)
-
-    for i_ch in range(n_chunks + 1 - overlap):
-        content = ''.join(text_chunks[i_ch:min(i_ch + overlap, n_chunks)])
-        head = ''.join(text_chunks[max(i_ch - context, 0):i_ch])
-        tail = ''.join(text_chunks[i_ch:min(i_ch + overlap + context, n_chunks)])
-        yield Piece(content, head, tail, sid=i_ch, pos=i_ch * ch_len)
+    if ch_len <= 0:
+        raise ValueError("length must not be smaller than overlap")
+    return ch_len
+
+
+def piece_spans(n, length, overlap, context=0):
+    """
+    Generate offset ranges of the pieces :py:func:`cut_pieces_txt` cuts from
+    a text of length `n`, as `Piece` of `(start, end)` tuples for content,
+    head and tail. No text is copied.
+    """
+    ch_len = chunk_length(length, overlap)
+    n_chunks = -(-n // ch_len)
+    for i_ch in xrange(n_chunks + 1 - overlap):
+        start = i_ch * ch_len
+        yield Piece((start, min(start + overlap * ch_len, n)),
+                    (max(i_ch - context, 0) * ch_len, start),
+                    (start, min(start + (overlap + context) * ch_len, n)),
+                    sid=i_ch, pos=start)
+
+
+class PieceView(object):
+    """Piece of `text` given by offsets, slicing content, head and tail only
+    when accessed. `text` may be a string or a memory-mapped file."""
+    __slots__ = ('text', 'spans')
+
+    def __init__(self, text, spans):
+        self.text = text
+        self.spans = spans
+
+    @property
+    def content(self):
+        return self.text[slice(*self.spans.content)]
+
+    @property
+    def head(self):
+        return self.text[slice(*self.spans.head)]
+
+    @property
+    def tail(self):
+        return self.text[slice(*self.spans.tail)]
+
+    @property
+    def sid(self):
+        return self.spans.sid
+
+    @property
+    def pos(self):
+        return self.spans.pos
+
+    def piece(self):
+        return Piece(self.content, self.head, self.tail, self.sid, self.pos)
+
+
+def cut_views(text, length, overlap, context=0):
+    """Like :py:func:`cut_pieces_txt` but generate :py:class:`PieceView`."""
+    for spans in piece_spans(len(text), length, overlap, context):
+        yield PieceView(text, spans)
+
+
+def cut_pieces_many(texts, length, overlap, context=0):
+    """
+    Cut many texts at once. Offsets only depend on the text length, so they
+    are computed once per distinct length. Return a list of lists of
+    :py:class:`PieceView`, one list per text.
+    """
+    spans_of = {}
+    result = []
+    for text in texts:
+        n = len(text)
+        if n not in spans_of:
+            spans_of[n] = list(piece_spans(n, length, overlap, context))
+        result.append([PieceView(text, spans) for spans in spans_of[n]])
+    return result
+
+
+@contextmanager
+def mapped_file(path):
+    """Memory-map file `path` read-only, e.g. to pass it to
+    :py:func:`cut_views`. Offsets and slices are then in bytes."""
+    with open(path, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield m
+        finally:
+            m.close()
+
 
 def idlize(txt):
     pre_txt = txt.lower().strip().replace(" ", "_").replace(".", "-")
@@ -13,4 +13,9 @@ setup(
     install_requires=[
         'requests', 'responses',
     ],
+    extras_require={
+        'pandas': ['pandas'],
+        'html': ['beautifulsoup4'],
+        'ujson': ['ujson'],
+    },
 )
\ No newline at end of file